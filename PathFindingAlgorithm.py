@@ -1,27 +1,187 @@
 from abc import ABCMeta, abstractmethod
 import networkx as nx
-import math
+import numpy as np
 import copy
+import heapq
+import math
+from collections import OrderedDict
+
+
+class SearchRecord():
+    """ What a single getPath call depended on and changed, so a route cache can replay it """
+
+    def __init__(self):
+        # Names of the nodes whose prices the search looked at
+        self.pricesRead = set()
+        # Names of the nodes that were told about the message, in order
+        self.messagesSeen = OrderedDict()
+        # Keys of nodes that were told about it all at once, like a flood of bid requests
+        self.messageSeenGroups = []
+
+
+class HeuristicTable():
+    """ Euclidean distances from every node to one destination, computed at once """
+
+    def __init__(self, distances, rows):
+        self.distances = distances
+        # Looked up through a memoryview, which gives Python floats rather than NumPy scalars
+        self.view = memoryview(distances)
+        # Node name -> row of distances on a networkx graph, or None when keys are rows
+        self.rows = rows
+
+    def __getitem__(self, nodeKey):
+        return self.view[nodeKey if self.rows is None else self.rows[nodeKey]]
+
+    def numBytes(self):
+        return self.distances.nbytes
+
+
+class LazyHeuristicTable():
+    """ Euclidean distances to one destination, each computed the first time it is looked up """
+
+    # Roughly what a dict entry holding a float costs
+    ENTRY_BYTES = 100
+
+    def __init__(self, algorithm, destinationNode):
+        self.algorithm = algorithm
+        self.lat = float(destinationNode.lat)
+        self.long = float(destinationNode.long)
+        # Looked up through memoryviews, like HeuristicTable
+        self.lats = memoryview(algorithm.heuristicLat)
+        self.longs = memoryview(algorithm.heuristicLong)
+        self.distances = {}
+
+    def __getitem__(self, nodeKey):
+        if nodeKey not in self.distances:
+            algorithm = self.algorithm
+            algorithm.heuristicEvaluations += 1
+            row = nodeKey if algorithm.heuristicRows is None else algorithm.heuristicRows[nodeKey]
+            latDifference = self.lats[row] - self.lat
+            longDifference = self.longs[row] - self.long
+            self.distances[nodeKey] = math.sqrt(latDifference * latDifference + longDifference * longDifference)
+        return self.distances[nodeKey]
+
+    def numBytes(self):
+        return len(self.distances) * self.ENTRY_BYTES
 
 
 class PathFindingAlgorithm:
-    def __init__(self, name):
+    # A destination's distances are computed for every node at once, rather than as they
+    # are looked up, when the graph has at most this many times as many nodes as a
+    # search usually looks up. NumPy computes a distance about this much faster.
+    FULL_HEURISTIC_RATIO = 50
+
+    def __init__(self, name, heuristicCacheBytes=64 * 1024 * 1024, cacheRoutes=False):
         self.name = name
 
+        # Whether Network may reuse this algorithm's routes until a price they depend on
+        # changes. While a route is being computed for the cache, searchRecord is set.
+        self.cacheRoutes = cacheRoutes
+        self.searchRecord = None
+
+        # Heuristic tables keyed by destination, evicted least recently used first once
+        # they take up more than heuristicCacheBytes. Node coordinates don't change, so
+        # the cache only needs clearing when the algorithm is handed a different graph.
+        self.heuristicCacheBytes = heuristicCacheBytes
+        self.heuristics = OrderedDict()
+        self.heuristicBytes = 0
+        self.heuristicGraph = None
+        self.heuristicRows = None
+        self.heuristicLat = None
+        self.heuristicLong = None
+        # The table handed out last, whose size may have grown since, whether it was new
+        # then, and its size in bytes when it was handed out
+        self.lastHeuristic = None
+        self.lastHeuristicNew = False
+        self.lastHeuristicBytes = 0
+        # Moving average of how many distances a search looks up, measured on new lazy tables
+        self.heuristicSearchSize = None
+
+        # Running totals that StatsCollector reads when profiling. A heuristic evaluation
+        # is one node's distance being computed, so lookups in a cached table don't count.
+        self.utilityEvaluations = 0
+        self.heuristicEvaluations = 0
+
     @abstractmethod
     def getPath(self, graph, message, stats):
         raise NotImplementedError()
 
     def euclideanDistance(self, graph, node1, node2):
-        firstNode = self.getNode(graph, node1)
-        secondNode = self.getNode(graph, node2)
-        latDist = abs(firstNode.lat - secondNode.lat)
-        lonDist = abs(firstNode.long - secondNode.long)
-        return math.sqrt(math.pow(latDist, 2) + math.pow(lonDist, 2))
+        return self.getHeuristic(graph, node2)[node1]
+
+    def getHeuristic(self, graph, destination):
+        """ Returns the euclidean distance from every node to destination, indexable by node """
+        if graph is not self.heuristicGraph:
+            self.heuristics.clear()
+            self.heuristicBytes = 0
+            self.lastHeuristic = None
+            self.heuristicSearchSize = None
+            self.heuristicGraph = graph
+            if isinstance(graph, nx.Graph):
+                names = list(graph.nodes)
+                self.heuristicRows = {name: row for row, name in enumerate(names)}
+                nodes = [self.getNode(graph, name) for name in names]
+                self.heuristicLat = np.array([node.lat for node in nodes], dtype=np.float64)
+                self.heuristicLong = np.array([node.long for node in nodes], dtype=np.float64)
+            else:
+                self.heuristicRows = None
+                self.heuristicLat, self.heuristicLong = graph.lat, graph.long
+
+        heuristic = self.heuristics.get(destination)
+        if heuristic is not None and heuristic is self.lastHeuristic:
+            return heuristic  # Still the most recently used
+
+        self.countLastHeuristic()
+        if heuristic is not None:
+            self.heuristics.move_to_end(destination)
+            self.setLastHeuristic(heuristic, False)
+            return heuristic
+
+        destinationNode = self.getNode(graph, destination)
+        numNodes = len(self.heuristicLat)
+        if self.heuristicSearchSize is not None and numNodes <= self.FULL_HEURISTIC_RATIO * self.heuristicSearchSize:
+            distances = np.sqrt(np.square(np.abs(self.heuristicLat - destinationNode.lat)) +
+                                np.square(np.abs(self.heuristicLong - destinationNode.long)))
+            self.heuristicEvaluations += numNodes
+            heuristic = HeuristicTable(distances, self.heuristicRows)
+        else:
+            heuristic = LazyHeuristicTable(self, destinationNode)
+
+        self.heuristics[destination] = heuristic
+        self.setLastHeuristic(heuristic, True)
+        while self.heuristicBytes > self.heuristicCacheBytes and len(self.heuristics) > 1:
+            _, evicted = self.heuristics.popitem(last=False)
+            self.heuristicBytes -= evicted.numBytes()
+        return heuristic
+
+    def countLastHeuristic(self):
+        """ Counts what the last table handed out grew by while it was being used """
+        heuristic = self.lastHeuristic
+        if heuristic is None:
+            return
+        numBytes = heuristic.numBytes()
+        self.heuristicBytes += numBytes - self.lastHeuristicBytes
+        if self.lastHeuristicNew and isinstance(heuristic, LazyHeuristicTable):
+            searchSize = len(heuristic.distances)
+            if self.heuristicSearchSize is None:
+                self.heuristicSearchSize = searchSize
+            else:
+                self.heuristicSearchSize = 0.9 * self.heuristicSearchSize + 0.1 * searchSize
+        self.lastHeuristic = None
+
+    def setLastHeuristic(self, heuristic, new):
+        self.lastHeuristic = heuristic
+        self.lastHeuristicNew = new
+        self.lastHeuristicBytes = heuristic.numBytes()
+        if new:
+            self.heuristicBytes += self.lastHeuristicBytes
 
     # TODO: Make this more interesting
     # def utilityFunction(self, message, node1, node2):
     def utilityFunction(self, message, node):
+        self.utilityEvaluations += 1
+        if self.searchRecord is not None:
+            self.searchRecord.pricesRead.add(node.name)
 
         speedPref = message.speedPref
         costPref = message.costPref
@@ -32,81 +192,137 @@ class PathFindingAlgorithm:
     def getNode(self, graph, nodeName):
         return graph.nodes[nodeName]['node']
 
+    def getNodeNames(self, graph, nodeKeys):
+        """ The names of the nodes with these keys, which on a networkx graph are the keys themselves """
+        if isinstance(graph, nx.Graph):
+            return nodeKeys
+        return [graph.names[nodeKey] for nodeKey in nodeKeys]
+
+    def buildPath(self, graph, message, route):
+        """ Turns a route from the sender's chosen neighbor to the destination into a priced path """
+        path = []
+        totalCost = 0
+        for nodeName in reversed(route):
+            cost = self.getNode(graph, nodeName).costPerMByte * message.size
+            totalCost += cost
+            path.append((nodeName, cost))
+        path.append((message.startingNode, -1*totalCost))
+        return path
+
+    def priceChanged(self, graph, nodeKey):
+        """
+        Called by Network whenever a node changes its price. Returns True if the change
+        also changed something every search depends on, like a heuristic, so the nodes
+        a cached route's search told about its message may no longer be the right ones.
+        """
+        return False
+
+    def recordMessageSeen(self, node, messageSender, messageId):
+        """ Counts the message towards the node's seen messages the first time the node hears of it """
+        if self.searchRecord is not None:
+            self.searchRecord.messagesSeen[node.name] = True
+
+        if node.seeMessage(messageSender, messageId):
+            node.numMessagesSeen += 1
+
+    def recordMessagesSeen(self, graph, nodeKeys, messageSender, messageId):
+        """ recordMessageSeen for a collection of nodes that each hear of a new message once """
+        if self.searchRecord is not None:
+            self.searchRecord.messageSeenGroups.append(nodeKeys)
+        nodes = graph.nodes
+        for nodeKey in nodeKeys:
+            node = nodes[nodeKey]['node']
+            if node.seeMessage(messageSender, messageId):
+                node.numMessagesSeen += 1
+
 
 class AStarAlgorithm(PathFindingAlgorithm):
     # Based on the pseudocode given at : https://en.wikipedia.org/wiki/A*_search_algorithm
     # Requires some central understanding
     def getPath(self, graph, message, stats):
-        # Set of nodes already evaluation
-        closedSet = []
+        # Set of nodes already evaluated
+        closedSet = set()
 
-        # Set of currently discovered nodes that are not evaluated yet
+        # Set of currently discovered nodes that are not evaluated yet.
+        # openSet is kept as a binary heap of (fScore, discoveryOrder, node) entries with
+        # lazy deletion: when a node's fScore improves a new entry is pushed and the stale
+        # one is skipped when popped. Ties on fScore are broken by the order in which nodes
+        # were discovered, which is the order the original list based open set used.
         # Initally only the start node is known
-        openSet = [message.startingNode]
+        openSet = []
+        inOpenSet = set()
+        discoveryOrder = {}
 
         # For each node, which node it can most efficiently be reached from.
         # If a node can be reached from many nodes, cameFrom will eventually contain the
         # most efficient previous step.
         cameFrom = {}
 
-        # For each node, the cost of getting from the start node to that node
-        gScores = {key: float('inf') for key in nx.nodes(graph)}
+        # For each node, the cost of getting from the start node to that node.
+        # Nodes missing from the dict have a score of infinity.
+        gScores = {}
 
         # The cost of going from start to start is zero
         gScores[message.startingNode] = 0
 
         # For each node, the total cost of getting from the start node ot the goal
         # by passing by that node. The value is partly known, partly heuristic
-        fScores = {key: float('inf') for key in nx.nodes(graph)}
+        fScores = {}
 
         # For the first node, the value is completely heuristic
-        fScores[message.startingNode] = self.euclideanDistance(
-            graph, message.startingNode, message.endingNode)
+        heuristic = self.getHeuristic(graph, message.endingNode)
+        fScores[message.startingNode] = heuristic[message.startingNode]
+        self.pushOpenNode(openSet, inOpenSet, discoveryOrder,
+                          message.startingNode, fScores[message.startingNode])
 
         messageSender = message.messageId[0]
         messageId = message.messageId[1]
 
-        while len(openSet) > 0:
-            currFScores = {node: fScores[node] for node in openSet}
-            current = min(currFScores, key=currFScores.get)
+        while len(inOpenSet) > 0:
+            currentF, _, current = heapq.heappop(openSet)
+            if current not in inOpenSet or currentF != fScores[current]:
+                continue  # Stale heap entry
 
             stats.visitedNode()
 
             if current == message.endingNode:
                 return self.reconstructPath(cameFrom, current, graph, message)
 
-            openSet.remove(current)
-            closedSet.append(current)
+            inOpenSet.remove(current)
+            closedSet.add(current)
 
-            for neighbor in nx.all_neighbors(graph, current):
+            for neighbor in graph.neighbors(current):
                 if neighbor in closedSet:
                     continue  # Ignore the neighbor which is already evaluated
                 stats.visitedNode()
 
-                if neighbor not in openSet:
-                    openSet.append(neighbor)
-
                 # The distance from start to a neighbor
                 # For our application, this is the utility function
                 neighborNode = self.getNode(graph, neighbor)
                 tentative_gScore = gScores[current] + \
                     self.utilityFunction(message, neighborNode)
 
-                if messageSender not in neighborNode.messagesSeen or messageId != neighborNode.messagesSeen[messageSender]:
-                    neighborNode.messagesSeen[messageSender] = messageId
-                    neighborNode.numMessagesSeen += 1
+                self.recordMessageSeen(neighborNode, messageSender, messageId)
 
-                if tentative_gScore >= gScores[neighbor]:
+                if tentative_gScore >= gScores.get(neighbor, float('inf')):
                     continue  # This is not a better path
 
                 # This is the current best path
                 cameFrom[neighbor] = current
                 gScores[neighbor] = tentative_gScore
-                fScores[neighbor] = gScores[neighbor] + \
-                    self.euclideanDistance(graph, neighbor, message.endingNode)
+                fScores[neighbor] = gScores[neighbor] + heuristic[neighbor]
+                self.pushOpenNode(openSet, inOpenSet, discoveryOrder,
+                                  neighbor, fScores[neighbor])
 
         return False  # Signal for failure for now
 
+    def pushOpenNode(self, openSet, inOpenSet, discoveryOrder, node, fScore):
+        """ Adds node to the open set heap, or re-prioritizes it if it is already there """
+        if node not in discoveryOrder:
+            discoveryOrder[node] = len(discoveryOrder)
+        inOpenSet.add(node)
+        heapq.heappush(openSet, (fScore, discoveryOrder[node], node))
+
     def reconstructPath(self, cameFrom, current, graph, message):
         """ Used in the A* algorithm to reconstruct the path """
         # NOTE:
@@ -134,8 +350,489 @@ class AStarAlgorithm(PathFindingAlgorithm):
         return node.costPerMByte * message.size
 
 
+class ALTAlgorithm(AStarAlgorithm):
+    """
+    Bidirectional A* with landmark (ALT) lower bounds measured in utility.
+
+    A route's utility is size * (speedPref * speed + costPref * costPerMByte) summed over
+    every node after the sender, so for each landmark the distances from it are
+    precomputed twice, once weighting nodes by speed and once by price. For any message
+    the two triangle inequality bounds combine, scaled by its preferences and size, into
+    a lower bound on the utility still to go, so the route found is the optimal one.
+
+    Speeds never change. When prices drop, the price distances overestimate, so they are
+    scaled down by the largest drop seen since they were computed, and recomputed on
+    the next search once that drop passes the tolerance. Either changes which nodes a
+    search visits, so Network drops its cached routes when they do.
+    """
+
+    def __init__(self, name, numLandmarks=8, tolerance=0.5, **kwargs):
+        AStarAlgorithm.__init__(self, name, **kwargs)
+        self.numLandmarks = numLandmarks
+        self.tolerance = tolerance
+
+        self.landmarkGraph = None
+        self.landmarks = []
+        # Node key -> row of the arrays below, or None when keys are already row numbers
+        self.landmarkRows = None
+        self.speeds = None
+        self.landmarkCosts = None
+        # One row per node and one column per landmark: the distance from the landmark
+        self.speedDistances = None
+        self.costDistances = None
+        # Smallest ratio of a node's price to its price in landmarkCosts
+        self.costScale = 1.0
+        self.costsStale = False
+
+    def getRow(self, nodeKey):
+        return nodeKey if self.landmarkRows is None else self.landmarkRows[nodeKey]
+
+    def landmarkDistances(self, graph, keys, source, weights):
+        """ Dijkstra from source, where entering a node costs its weight """
+        distances = np.full(len(keys), np.inf)
+        distances[self.getRow(source)] = 0.0
+        done = set()
+        heap = [(0.0, self.getRow(source), source)]
+        while heap:
+            distance, row, current = heapq.heappop(heap)
+            if row in done:
+                continue
+            done.add(row)
+            for neighbor in graph.neighbors(current):
+                neighborRow = self.getRow(neighbor)
+                neighborDistance = distance + weights[neighborRow]
+                if neighborDistance < distances[neighborRow]:
+                    distances[neighborRow] = neighborDistance
+                    heapq.heappush(heap, (neighborDistance, neighborRow, neighbor))
+        return distances
+
+    def updateLandmarks(self, graph):
+        """ Picks the landmarks for a new graph, and recomputes the price distances when they are stale """
+        if graph is not self.landmarkGraph:
+            self.landmarkGraph = graph
+            if isinstance(graph, nx.Graph):
+                keys = list(graph.nodes)
+                self.landmarkRows = {key: row for row, key in enumerate(keys)}
+            else:
+                keys = list(range(len(graph)))
+                self.landmarkRows = None
+            self.speeds = np.array([self.getNode(graph, key).speed for key in keys], dtype=np.float64)
+
+            # Farthest point selection: each landmark is the node furthest from the ones
+            # already chosen, starting with the node furthest from the best connected node.
+            # Only nodes it can reach are candidates, so landmarks aren't wasted on small
+            # disconnected pieces of the graph.
+            self.landmarks = []
+            speedDistances = []
+            if keys:
+                hub = max(keys, key=lambda key: len(list(graph.neighbors(key))))
+                closest = self.landmarkDistances(graph, keys, hub, self.speeds)
+            for _ in range(min(self.numLandmarks, len(keys))):
+                landmark = keys[int(np.argmax(np.where(np.isfinite(closest), closest, -1)))]
+                self.landmarks.append(landmark)
+                speedDistances.append(self.landmarkDistances(graph, keys, landmark, self.speeds))
+                closest = np.minimum(closest, speedDistances[-1]) if len(speedDistances) > 1 else speedDistances[-1]
+            self.speedDistances = np.array(speedDistances).T.reshape(len(keys), len(self.landmarks))
+            self.costsStale = True
+
+        if self.costsStale:
+            keys = list(self.landmarkRows) if self.landmarkRows is not None else list(range(len(graph)))
+            self.landmarkCosts = np.array([self.getNode(graph, key).costPerMByte for key in keys], dtype=np.float64)
+            costDistances = [self.landmarkDistances(graph, keys, landmark, self.landmarkCosts)
+                             for landmark in self.landmarks]
+            self.costDistances = np.array(costDistances).T.reshape(len(keys), len(self.landmarks))
+            self.costScale = 1.0
+            self.costsStale = False
+
+    def priceChanged(self, graph, nodeKey):
+        if graph is not self.landmarkGraph or self.costsStale:
+            return False
+        row = self.getRow(nodeKey)
+        if self.landmarkCosts[row] > 0:
+            ratio = self.getNode(graph, nodeKey).costPerMByte / self.landmarkCosts[row]
+            if ratio < self.costScale:
+                # Every bound changes, and with them the nodes each search visits
+                self.costScale = ratio
+                if self.costScale < 1 - self.tolerance:
+                    self.costsStale = True
+                return True
+        return False
+
+    def componentBound(self, distances, weights, fromRow, toRow):
+        """ Lower bound on the distance from one node to another, in one component's weights """
+        bound = 0.0
+        weightChange = weights[toRow] - weights[fromRow]
+        for fromDistance, toDistance in zip(distances[fromRow].tolist(), distances[toRow].tolist()):
+            if fromDistance == float('inf') or toDistance == float('inf'):
+                continue  # The landmark can't reach one of them, so it says nothing
+            # Going through the landmark, and coming from it. Distances from a landmark
+            # don't count its own weight, so going towards it is weight dependent.
+            bound = max(bound, fromDistance - toDistance + weightChange, toDistance - fromDistance)
+        return bound
+
+    def lowerBound(self, message, fromRow, toRow):
+        return message.size * (message.speedPref * self.componentBound(self.speedDistances, self.speeds,
+                                                                       fromRow, toRow) +
+                               message.costPref * self.costScale * self.componentBound(self.costDistances,
+                                                                                       self.landmarkCosts,
+                                                                                       fromRow, toRow))
+
+    def getPath(self, graph, message, stats):
+        start = message.startingNode
+        end = message.endingNode
+        if start == end:
+            return self.reconstructPath({}, start, graph, message)
+        self.updateLandmarks(graph)
+        startRow = self.getRow(start)
+        endRow = self.getRow(end)
+
+        # Average of the forward and backward bounds, which keeps both searches consistent
+        potentials = {}
+
+        def potential(node):
+            if node not in potentials:
+                row = self.getRow(node)
+                potentials[node] = (self.lowerBound(message, row, endRow) -
+                                    self.lowerBound(message, startRow, row)) / 2.0
+            return potentials[node]
+
+        messageSender = message.messageId[0]
+        messageId = message.messageId[1]
+
+        # Both searches keep (reduced distance, push order, node) heaps. A forward step
+        # into a node costs that node's utility, and so does a backward step out of it.
+        # Reduced distances add the potential (forwards) or subtract it (backwards).
+        gScores = [{start: 0.0}, {end: 0.0}]
+        cameFrom = [{}, {}]
+        closedSets = [set(), set()]
+        heaps = [[(potential(start), 0, start)], [(-potential(end), 0, end)]]
+        pushes = 1
+        signs = [1, -1]
+
+        bestUtility = float('inf')
+        meetingNode = None
+        while heaps[0] and heaps[1]:
+            # Stop once no route through an unsettled node can beat the best one found.
+            # A node's forward and backward keys add up to the utility of the route
+            # through it, since the potentials cancel.
+            if heaps[0][0][0] + heaps[1][0][0] >= bestUtility:
+                break
+
+            # Advance whichever search has the smaller frontier
+            direction = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+            _, _, current = heapq.heappop(heaps[direction])
+            if current in closedSets[direction]:
+                continue  # Stale heap entry
+            closedSets[direction].add(current)
+            stats.visitedNode()
+
+            gScore = gScores[direction][current]
+            if direction == 1:
+                # Every backward step out of current enters it going forwards
+                currentUtility = self.utilityFunction(message, self.getNode(graph, current))
+
+            for neighbor in graph.neighbors(current):
+                if neighbor in closedSets[direction]:
+                    continue
+                stats.visitedNode()
+
+                neighborNode = self.getNode(graph, neighbor)
+                self.recordMessageSeen(neighborNode, messageSender, messageId)
+                if direction == 0:
+                    tentative_gScore = gScore + self.utilityFunction(message, neighborNode)
+                else:
+                    tentative_gScore = gScore + currentUtility
+
+                if tentative_gScore >= gScores[direction].get(neighbor, float('inf')):
+                    continue  # This is not a better path
+
+                gScores[direction][neighbor] = tentative_gScore
+                cameFrom[direction][neighbor] = current
+                heapq.heappush(heaps[direction],
+                               (tentative_gScore + signs[direction] * potential(neighbor), pushes, neighbor))
+                pushes += 1
+
+                if neighbor in gScores[1 - direction]:
+                    utility = tentative_gScore + gScores[1 - direction][neighbor]
+                    if utility < bestUtility:
+                        bestUtility = utility
+                        meetingNode = neighbor
+
+        if meetingNode is None:
+            return False  # Signal for failure for now
+
+        # Join the two halves into one chain of cameFrom links ending at the destination
+        forwardCameFrom = dict(cameFrom[0])
+        current = meetingNode
+        while current != end:
+            nextNode = cameFrom[1][current]
+            forwardCameFrom[nextNode] = current
+            current = nextNode
+        return self.reconstructPath(forwardCameFrom, end, graph, message)
+
+
+class ReverseUtilityTree():
+    """
+    Dijkstra search over node utilities grown backwards from a message's destination.
+    The bid of a node is the utility of the best route from that node to the destination,
+    counting every node on the route including both ends. The tree is only grown as far as
+    needed to answer the bids that have been asked for, and can be reused for any message
+    with the same destination, preferences and size while prices stay the same.
+    """
+
+    def __init__(self, algorithm, graph, message):
+        self.algorithm = algorithm
+        self.graph = graph
+        self.message = message
+        self.destination = message.endingNode
+
+        # Settled bids, and the next hop on the best route to the destination
+        self.bids = {}
+        self.nextHop = {}
+
+        destinationUtility = self.nodeUtility(self.destination)
+        self.tentativeBids = {self.destination: destinationUtility}
+        self.frontier = [(destinationUtility, 0, self.destination)]
+        self.pushes = 1
+
+    def nodeUtility(self, nodeName):
+        return self.algorithm.utilityFunction(self.message, self.algorithm.getNode(self.graph, nodeName))
+
+    def getBid(self, nodeName):
+        while nodeName not in self.bids and len(self.frontier) > 0:
+            bid, _, current = heapq.heappop(self.frontier)
+            if current in self.bids:
+                continue  # Stale heap entry
+
+            self.bids[current] = bid
+            for neighbor in self.graph.neighbors(current):
+                if neighbor in self.bids:
+                    continue
+                neighborBid = bid + self.nodeUtility(neighbor)
+                if neighborBid < self.tentativeBids.get(neighbor, float('inf')):
+                    self.tentativeBids[neighbor] = neighborBid
+                    self.nextHop[neighbor] = current
+                    heapq.heappush(self.frontier, (neighborBid, self.pushes, neighbor))
+                    self.pushes += 1
+
+        return self.bids.get(nodeName, float('inf'))
+
+    def pricesBelow(self, bid):
+        """
+        The nodes whose prices decide which bids are at most bid: the nodes settled with
+        such a bid, and every node next to them. The tree may have been grown further by
+        other messages, but another price can only change bids above this one.
+        """
+        nodes = set()
+        for nodeName, settledBid in self.bids.items():
+            if settledBid <= bid:
+                nodes.add(nodeName)
+                nodes.update(self.graph.neighbors(nodeName))
+        return nodes
+
+    def getRoute(self, nodeName):
+        """ Returns the nodes on the best route, from nodeName to the destination """
+        route = [nodeName]
+        while route[-1] != self.destination:
+            route.append(self.nextHop[route[-1]])
+        return route
+
+
 class AgentApproach(PathFindingAlgorithm):
+    """
+    Every neighbor of the sender bids the utility of its best route to the destination,
+    and the sender picks the lowest bid.
+
+    By default the bids are computed exactly with a shared reverse Dijkstra tree per
+    destination, cached until the next price change. Passing maxHops only considers
+    routes of at most that many hops, and exhaustive=True enumerates every simple path
+    the way the agents originally did.
+    """
+
+    def __init__(self, name, maxHops=None, exhaustive=False, cacheSize=32, cacheRoutes=False):
+        PathFindingAlgorithm.__init__(self, name, cacheRoutes=cacheRoutes)
+        self.maxHops = maxHops
+        self.exhaustive = exhaustive
+        self.cacheSize = cacheSize
+
+        # Bid trees keyed by (destination, speedPref, costPref, size) for the current price epoch
+        self.bidTrees = OrderedDict()
+        self.bidTreesEpoch = None
+
+        # Components and blocks of the graph without each destination, used to work out
+        # which agents a bid request reaches
+        self.bidRequestTopologies = OrderedDict()
+
+        # Set to a list by Network while it routes a batch of messages. Floods then add the
+        # node keys they reach to it, and Network counts them as seen in bulk afterwards.
+        self.batchMessagesSeen = None
+
     def getPath(self, graph, message, stats):
+        if self.exhaustive:
+            return self.getExhaustivePath(graph, message, stats)
+        if self.maxHops is not None:
+            return self.getBoundedPath(graph, message, stats)
+        return self.getExactPath(graph, message, stats)
+
+    def getExactPath(self, graph, message, stats):
+        start = message.startingNode
+        self.floodBidRequest(graph, message, stats)
+        bidTree = self.getBidTree(graph, message)
+
+        bestNeighbor = None
+        bestUtility = float('inf')
+        for neighbor in graph.neighbors(start):
+            utility = bidTree.getBid(neighbor)
+            if utility < bestUtility and start not in bidTree.getRoute(neighbor):
+                bestNeighbor = neighbor
+                bestUtility = utility
+
+        if bestNeighbor is None:
+            return False  # The destination can't be reached
+
+        if self.searchRecord is not None:
+            self.searchRecord.pricesRead.update(self.getNodeNames(graph, bidTree.pricesBelow(bestUtility)))
+
+        return self.buildPath(graph, message, bidTree.getRoute(bestNeighbor))
+
+    def getBoundedPath(self, graph, message, stats):
+        start = message.startingNode
+        messageSender = message.messageId[0]
+        messageId = message.messageId[1]
+
+        # Layered search forwards from the sender, one layer per hop.
+        # A node is only carried to the next layer if it was reached more cheaply than in
+        # any earlier layer, since an earlier layer has more hops left to spend.
+        bestUtilities = {start: 0}
+        bestLayers = {}
+        cameFrom = []
+        layer = {start: 0}
+        for hop in range(self.maxHops):
+            nextLayer = {}
+            layerCameFrom = {}
+            for current, utility in layer.items():
+                if current == message.endingNode:
+                    continue  # The recipient doesn't pass the request on
+                for neighbor in graph.neighbors(current):
+                    if neighbor == start:
+                        continue
+                    stats.visitedNode()
+                    neighborNode = self.getNode(graph, neighbor)
+                    if current != start:
+                        self.recordMessageSeen(neighborNode, messageSender, messageId)
+
+                    neighborUtility = utility + self.utilityFunction(message, neighborNode)
+                    if neighborUtility < bestUtilities.get(neighbor, float('inf')) and \
+                            neighborUtility < nextLayer.get(neighbor, float('inf')):
+                        nextLayer[neighbor] = neighborUtility
+                        layerCameFrom[neighbor] = current
+
+            bestUtilities.update(nextLayer)
+            for neighbor in nextLayer:
+                bestLayers[neighbor] = hop
+            cameFrom.append(layerCameFrom)
+            layer = nextLayer
+
+        if message.endingNode not in bestLayers:
+            return False  # No route within maxHops
+
+        route = [message.endingNode]
+        for hop in range(bestLayers[message.endingNode], 0, -1):
+            route.append(cameFrom[hop][route[-1]])
+        route.reverse()
+        return self.buildPath(graph, message, route)
+
+    def getBidTree(self, graph, message):
+        priceEpoch = graph.graph.get('priceEpoch', 0)
+        if priceEpoch != self.bidTreesEpoch:
+            self.bidTrees.clear()
+            self.bidTreesEpoch = priceEpoch
+
+        key = (message.endingNode, message.speedPref, message.costPref, message.size)
+        if key in self.bidTrees:
+            self.bidTrees.move_to_end(key)
+            return self.bidTrees[key]
+
+        bidTree = ReverseUtilityTree(self, graph, message)
+        self.bidTrees[key] = bidTree
+        if len(self.bidTrees) > self.cacheSize:
+            self.bidTrees.popitem(last=False)
+        return bidTree
+
+    def floodBidRequest(self, graph, message, stats):
+        """
+        Records the bid requests the agents would have sent each other for this message.
+        The sender asks each of its neighbors, and every other agent passes the request on
+        to its neighbors that aren't already on the route the request took to reach it.
+        """
+        askedBySender, askedByAgents = self.getBidRequestFlood(
+            graph, message.startingNode, message.endingNode)
+
+        stats.visitedNodes(len(askedBySender) + len(askedByAgents))
+        self.recordMessagesSeen(graph, askedByAgents, message.messageId[0], message.messageId[1])
+
+    def recordMessagesSeen(self, graph, nodeKeys, messageSender, messageId):
+        if self.batchMessagesSeen is None:
+            PathFindingAlgorithm.recordMessagesSeen(self, graph, nodeKeys, messageSender, messageId)
+            return
+        if self.searchRecord is not None:
+            self.searchRecord.messageSeenGroups.append(nodeKeys)
+        # The message was only just created, so none of them can have seen it yet
+        self.batchMessagesSeen.append(nodeKeys)
+
+    def getBidRequestFlood(self, graph, start, end):
+        components, blocks = self.getBidRequestTopology(graph, end)
+
+        # Nodes the request can reach without passing through the sender or the recipient
+        reached = components.get(start, set()) - {start}
+
+        senderNeighbors = set(graph.neighbors(start))
+        askedByAgents = reached - senderNeighbors
+        if any(neighbor in reached for neighbor in graph.neighbors(end)):
+            askedByAgents.add(end)
+
+        # A neighbor of the sender is also asked by another agent unless its only link back
+        # to the sender's side of the graph is the sender itself, i.e. the edge between them
+        # is a bridge in the graph without the recipient
+        for block in blocks.get(start, []):
+            if len(block) > 2:
+                askedByAgents |= block & senderNeighbors
+
+        askedBySender = senderNeighbors - askedByAgents
+        return askedBySender, askedByAgents
+
+    def getBidRequestTopology(self, graph, end):
+        """
+        Returns the connected components and biconnected blocks of the graph without end,
+        each keyed by the nodes in them. This only depends on the topology, so it is cached
+        per destination and shared by every sender.
+        """
+        if end in self.bidRequestTopologies:
+            self.bidRequestTopologies.move_to_end(end)
+            return self.bidRequestTopologies[end]
+
+        # A plain copy of the topology is much quicker to search than a networkx subgraph view
+        searchGraph = nx.Graph()
+        searchGraph.add_nodes_from(node for node in graph if node != end)
+        searchGraph.add_edges_from((node, neighbor) for node in searchGraph
+                                   for neighbor in graph.neighbors(node) if neighbor != end)
+
+        components = {}
+        for component in nx.connected_components(searchGraph):
+            for node in component:
+                components[node] = component
+
+        blocks = {}
+        for block in nx.biconnected_components(searchGraph):
+            for node in block:
+                blocks.setdefault(node, []).append(block)
+
+        self.bidRequestTopologies[end] = (components, blocks)
+        if len(self.bidRequestTopologies) > self.cacheSize:
+            self.bidRequestTopologies.popitem(last=False)
+        return components, blocks
+
+    def getExhaustivePath(self, graph, message, stats):
         bestBid = {'path': [], 'utility': float(
             'inf'), 'totalCost': float('inf')}
         for neighbor in graph.neighbors(message.startingNode):
@@ -143,6 +840,9 @@ class AgentApproach(PathFindingAlgorithm):
             if bid['utility'] < bestBid['utility']:
                 bestBid = bid
 
+        if bestBid['utility'] == float('inf'):
+            return False  # The destination can't be reached, as in getExactPath
+
         bestPath = bestBid['path'] + \
             [(message.startingNode, -1*bestBid['totalCost'])]
         return bestPath
@@ -173,9 +873,7 @@ class AgentApproach(PathFindingAlgorithm):
         messageId = message.messageId[1]
         for neighbor in notVisitedNeighbors:
             neighborNode = self.getNode(graph, neighbor)
-            if messageSender not in neighborNode.messagesSeen or messageId != neighborNode.messagesSeen[messageSender]:
-                neighborNode.messagesSeen[messageSender] = messageId
-                neighborNode.numMessagesSeen += 1
+            self.recordMessageSeen(neighborNode, messageSender, messageId)
 
             neighborsOffer = self.getBid(
                 graph, neighbor, message, currentVisitedNodes, stats)
@@ -191,26 +889,56 @@ class AgentApproach(PathFindingAlgorithm):
 
 class AgentApproximation(PathFindingAlgorithm):
     def getPath(self, graph, message, stats):
-        validPath, path = self.findApproximatePath(graph, message, message.startingNode, [], stats)
+        validPath, path = self.findApproximatePath(graph, message, stats)
         return path
 
-    def findApproximatePath(self, graph, message, currentNode, visitedNodes, stats):
-        myNode = self.getNode(graph, currentNode)
-        myPrice = myNode.costPerMByte * message.size
+    def findApproximatePath(self, graph, message, stats):
+        # If the starting node is the ending node, we are done
+        if message.startingNode == message.endingNode:
+            myNode = self.getNode(graph, message.startingNode)
+            return True, [(message.startingNode, myNode.costPerMByte * message.size)]
 
-        # If the current node is the ending node, we are done
-        if currentNode == message.endingNode:
-            return True, [(currentNode, myPrice)]  # True means reached end
+        # Depth first search with an explicit stack instead of recursion, so long routes
+        # aren't limited by the recursion limit. Each frame is a node on the current route
+        # and the neighbors it hasn't tried yet. visitedNodes always holds exactly the nodes
+        # on the current route, and is undone when we backtrack rather than copied.
+        visitedNodes = set()
+        route = []
+        self.visitApproximateNode(graph, message, message.startingNode, visitedNodes, route, stats)
 
-        # Deep copy currentVisitedNodes, just in case we backtrack
-        currentVisitedNodes = copy.deepcopy(visitedNodes)
-        currentVisitedNodes.append(currentNode)
+        # Find the neighbor with the minimum approximation and try to find a path from that node.
+        # If there is a valid path to the end node from that neighbor, we are done.
+        # Otherwise, try going to the next best approximation, until no neighbors are valid
+        while len(route) > 0:
+            currentNode, neighborApproximations = route[-1]
+            if len(neighborApproximations) == 0:
+                # There is no valid path from the current node to the goal node
+                print('Returned false')
+                route.pop()
+                visitedNodes.remove(currentNode)
+                continue
+
+            bestApprox = min(neighborApproximations,
+                             key=neighborApproximations.get)
+            neighborApproximations.pop(bestApprox)
+
+            if bestApprox == message.endingNode:
+                return True, self.buildApproximatePath(graph, message, route)
+
+            self.visitApproximateNode(graph, message, bestApprox, visitedNodes, route, stats)
+
+        return False, []
+
+    def visitApproximateNode(self, graph, message, currentNode, visitedNodes, route, stats):
+        """ Pushes currentNode on to the route along with the approximations for its unvisited neighbors """
+        visitedNodes.add(currentNode)
 
         # Loop through each neighbor that hasn't already been visited
-        # and approximate the utility of traveling in that direction
+        # and approximate the utility of traveling in that direction.
+        # The neighbors are still gathered into a fresh set, since the order they are tried
+        # in when approximations tie comes from iterating that set
         neighborApproximations = {}
-        notVisitedNeighbors = list(
-            set(graph.neighbors(currentNode)) - set(currentVisitedNodes))
+        notVisitedNeighbors = set(graph.neighbors(currentNode)) - visitedNodes
 
         messageSender = message.messageId[0]
         messageId = message.messageId[1]
@@ -220,31 +948,22 @@ class AgentApproximation(PathFindingAlgorithm):
             stats.visitedNode()
 
             neighborNode = self.getNode(graph, neighbor)
-            if messageSender not in neighborNode.messagesSeen or messageId != neighborNode.messagesSeen[messageSender]:
-                neighborNode.messagesSeen[messageSender] = messageId
-                neighborNode.numMessagesSeen += 1
+            self.recordMessageSeen(neighborNode, messageSender, messageId)
 
-        # Find the neighbor with the minimum approximation and try to find a path from that node.
-        # If there is a valid path to the end node from that neighbor, we are done, just add ourselves.
-        # Otherwise, try going to the next best approximation, until no neighbors are valid
-        while len(neighborApproximations) > 0:
-            bestApprox = min(neighborApproximations,
-                             key=neighborApproximations.get)
-            validPathFound, path = self.findApproximatePath(
-                graph, message, bestApprox, currentVisitedNodes, stats)
-            if validPathFound:
-                if currentNode == message.startingNode:
-                    # If a valid path is found from the starting node,
-                    # The price to append on to the path is what it needs pay
-                    myPrice = 0
-                    for i in range(len(path)):
-                        myPrice -= path[i][1]
-                return True, path + [(currentNode, myPrice)]
-            neighborApproximations.pop(bestApprox)
+        route.append((currentNode, neighborApproximations))
 
-        # There is no valid path from the current node to the goal node
-        print('Returned false')
-        return False, []
+    def buildApproximatePath(self, graph, message, route):
+        # Each node charges its price, and the starting node pays for all of them
+        endNode = self.getNode(graph, message.endingNode)
+        path = [(message.endingNode, endNode.costPerMByte * message.size)]
+        totalPrice = path[0][1]
+        for currentNode, _ in reversed(route[1:]):
+            myPrice = self.getNode(graph, currentNode).costPerMByte * message.size
+            totalPrice += myPrice
+            path.append((currentNode, myPrice))
+
+        path.append((message.startingNode, -1*totalPrice))
+        return path
 
     def getApproximateUtility(self, graph, message, node):
         if node == message.endingNode:
@@ -257,3 +976,247 @@ class AgentApproximation(PathFindingAlgorithm):
 
         # Scalar may be changed in future
         return knownUtility + (1 * distanceToTarget)
+
+
+class RouteFrontier():
+    """
+    The Pareto frontier of routes between two nodes. A route's utility for a message is
+    size * (speedPref * totalSpeed + costPref * totalPrice), with both totals summed over
+    every node after the sender, so whatever a sender's preferences its best route is one
+    that no other route beats on both totals. The frontier keeps one route for each such
+    pair of totals, and any message between the two nodes can pick its route from it.
+
+    search finds the whole frontier at once with a bi-objective A* search (BOA*). Routes
+    are grown in lexicographic order of their (speed, price) lower bounds, taken from a
+    ParetoAlgorithm's landmarks, so a route only needs keeping if it is cheaper than
+    every route popped before it at the same node.
+    """
+
+    def __init__(self, algorithm, graph, start, end):
+        self.algorithm = algorithm
+        self.graph = graph
+        self.start = start
+        self.end = end
+
+        # (totalSpeed, totalPrice, route) for each Pareto optimal route, fastest first.
+        # A route lists its nodes from start to end.
+        self.routes = []
+
+        # The nodes the search told about its message, in order, and the names of the
+        # nodes whose prices it looked at
+        self.nodesQueried = []
+        self.pricesRead = set()
+
+    def search(self, stats=None):
+        algorithm = self.algorithm
+        graph = self.graph
+        endRow = algorithm.getRow(self.end)
+        queried = set()
+        # Lower bounds on the (speed, price) still to go from each node
+        bounds = {}
+
+        # The lowest price of the routes popped so far at each node. Routes are popped
+        # fastest first, so one that isn't cheaper than that is dominated.
+        bestPrices = {}
+        endPrice = float('inf')
+
+        # Heap of (speed bound, price bound, push order, speed, price, label), where a
+        # label is a (node, previous label) linked list of the route back to the start
+        openSet = [(0, 0, 0, 0, 0, (self.start, None))]
+        pushes = 1
+        while len(openSet) > 0:
+            _, priceBound, _, speed, price, label = heapq.heappop(openSet)
+            current = label[0]
+            if price >= bestPrices.get(current, float('inf')) or priceBound >= endPrice:
+                continue  # Dominated since it was pushed
+            bestPrices[current] = price
+            if stats is not None:
+                stats.visitedNode()
+
+            if current == self.end:
+                endPrice = price
+                self.routes.append((speed, price, self.getRoute(label)))
+                continue
+
+            for neighbor in graph.neighbors(current):
+                if stats is not None:
+                    stats.visitedNode()
+                if neighbor not in queried:
+                    queried.add(neighbor)
+                    self.nodesQueried.append(neighbor)
+
+                neighborNode = algorithm.getNode(graph, neighbor)
+                neighborPrice = price + neighborNode.costPerMByte
+                if neighborPrice >= bestPrices.get(neighbor, float('inf')):
+                    continue
+                if neighbor not in bounds:
+                    bounds[neighbor] = algorithm.remainingBounds(neighbor, endRow)
+                speedToGo, priceToGo = bounds[neighbor]
+                if neighborPrice + priceToGo >= endPrice:
+                    continue
+                neighborSpeed = speed + neighborNode.speed
+                heapq.heappush(openSet, (neighborSpeed + speedToGo, neighborPrice + priceToGo, pushes,
+                                         neighborSpeed, neighborPrice, (neighbor, label)))
+                pushes += 1
+
+        self.pricesRead = set(algorithm.getNode(graph, nodeKey).name for nodeKey in queried)
+        return self
+
+    def getRoute(self, label):
+        route = []
+        while label is not None:
+            route.append(label[0])
+            label = label[1]
+        route.reverse()
+        return route
+
+    def bestRoute(self, speedPref, costPref):
+        """
+        The (totalSpeed, totalPrice, route) with the lowest utility for the preferences,
+        or None if the nodes aren't connected. Ties go to the faster route.
+        """
+        if len(self.routes) == 0:
+            return None
+        return min(self.routes, key=lambda route: speedPref * route[0] + costPref * route[1])
+
+
+class ParetoAlgorithm(ALTAlgorithm):
+    """
+    Routes each message along the best route for its preferences on the Pareto frontier
+    between its sender and destination. Frontiers are cached by (start, end) until the
+    next price change, so messages between the same nodes share one search whatever
+    their preferences and sizes. The frontier search is bounded with the speed and price
+    distances of ALTAlgorithm's landmarks, kept up to date the same way. A frontier costs
+    several single route searches, so this only pays off when messages between the same
+    nodes come in groups between price changes.
+
+    getFrontier and getKBestPaths answer route queries directly, without a message
+    being sent.
+    """
+
+    def __init__(self, name, cacheSize=32, **kwargs):
+        ALTAlgorithm.__init__(self, name, **kwargs)
+        self.cacheSize = cacheSize
+
+        # Frontiers keyed by (start, end) for the current price epoch
+        self.frontiers = OrderedDict()
+        self.frontiersEpoch = None
+
+    def getPath(self, graph, message, stats):
+        frontier = self.getFrontier(graph, message.startingNode, message.endingNode, stats)
+
+        # The nodes the frontier search asked hear about every message routed with it
+        self.recordMessagesSeen(graph, frontier.nodesQueried, message.messageId[0], message.messageId[1])
+        if self.searchRecord is not None:
+            self.searchRecord.pricesRead.update(frontier.pricesRead)
+
+        best = frontier.bestRoute(message.speedPref, message.costPref)
+        if best is None:
+            return False
+        return self.buildPath(graph, message, best[2][1:])
+
+    def getFrontier(self, graph, start, end, stats=None):
+        """ The RouteFrontier from start to end at the current prices """
+        priceEpoch = graph.graph.get('priceEpoch', 0)
+        if priceEpoch != self.frontiersEpoch:
+            self.frontiers.clear()
+            self.frontiersEpoch = priceEpoch
+
+        key = (start, end)
+        if key in self.frontiers:
+            self.frontiers.move_to_end(key)
+            return self.frontiers[key]
+
+        self.updateLandmarks(graph)
+        frontier = RouteFrontier(self, graph, start, end).search(stats)
+        self.frontiers[key] = frontier
+        if len(self.frontiers) > self.cacheSize:
+            self.frontiers.popitem(last=False)
+        return frontier
+
+    def remainingBounds(self, nodeKey, endRow):
+        """ Lower bounds on the total speed and price of the rest of a route from a node to the end """
+        row = self.getRow(nodeKey)
+        return (self.componentBound(self.speedDistances, self.speeds, row, endRow),
+                self.costScale * self.componentBound(self.costDistances, self.landmarkCosts, row, endRow))
+
+    def getKBestPaths(self, graph, message, k, stats=None):
+        """
+        The k lowest utility simple paths for the message, best first, as priced paths.
+        This is Yen's algorithm: each path after the first is the best way of leaving one
+        of the paths already found at one of its nodes, so it needs a search per node of
+        each path found. Fewer than k are returned if there aren't k paths.
+        """
+        utilities = {}
+
+        def utility(nodeKey):
+            if nodeKey not in utilities:
+                utilities[nodeKey] = self.utilityFunction(message, self.getNode(graph, nodeKey))
+            return utilities[nodeKey]
+
+        end = message.endingNode
+        best = self.getCheapestRoute(graph, message.startingNode, end, utility, set(), set(), stats)
+        if best is None:
+            return []
+        routes = [best]
+        found = set([tuple(best[1])])
+        candidates = []
+        while len(routes) < k:
+            _, previous = routes[-1]
+            for i in range(len(previous) - 1):
+                root = previous[:i + 1]
+                # Leave the root by a different next hop than every path found so far that shares it
+                usedHops = set(route[i + 1] for _, route in routes if route[:i + 1] == root)
+                spur = self.getCheapestRoute(graph, root[-1], end, utility, set(root[:-1]), usedHops, stats)
+                if spur is None:
+                    continue
+                route = root[:-1] + spur[1]
+                if tuple(route) in found:
+                    continue
+                found.add(tuple(route))
+                rootUtility = sum(utility(nodeKey) for nodeKey in root[1:])
+                heapq.heappush(candidates, (rootUtility + spur[0], len(found), route))
+
+            if len(candidates) == 0:
+                break
+            totalUtility, _, route = heapq.heappop(candidates)
+            routes.append((totalUtility, route))
+
+        return [self.buildPath(graph, message, route[1:]) for _, route in routes]
+
+    def getCheapestRoute(self, graph, start, end, utility, removedNodes, removedFirstHops, stats):
+        """
+        Dijkstra search for the (utility, route) of the lowest utility route from start to
+        end that avoids removedNodes and doesn't leave start for any of removedFirstHops
+        """
+        utilities = {start: 0}
+        cameFrom = {}
+        done = set()
+        heap = [(0, 0, start)]
+        pushes = 1
+        while len(heap) > 0:
+            currentUtility, _, current = heapq.heappop(heap)
+            if current in done:
+                continue
+            if stats is not None:
+                stats.visitedNode()
+            if current == end:
+                route = [end]
+                while route[-1] != start:
+                    route.append(cameFrom[route[-1]])
+                route.reverse()
+                return currentUtility, route
+            done.add(current)
+
+            for neighbor in graph.neighbors(current):
+                if neighbor in done or neighbor in removedNodes:
+                    continue
+                if current == start and neighbor in removedFirstHops:
+                    continue
+                neighborUtility = currentUtility + utility(neighbor)
+                if neighborUtility < utilities.get(neighbor, float('inf')):
+                    utilities[neighbor] = neighborUtility
+                    cameFrom[neighbor] = current
+                    heapq.heappush(heap, (neighborUtility, pushes, neighbor))
+                    pushes += 1
+        return None
@@ -0,0 +1,408 @@
+import argparse
+import asyncio
+import datetime
+import gc
+import itertools
+import math
+import random
+import selectors
+import time
+import numpy as np
+
+import PathFindingAlgorithm
+import topology
+import workload
+from graph import Network, StatsCollector
+
+# Kinds of item an agent finds in its inbox
+BID_REQUEST = 0
+BID = 1
+DEADLINE = 2
+
+# A run allocates millions of short lived items and bid request states, so the garbage
+# collector is run far less often than usual while it goes
+RUN_GC_THRESHOLDS = (50000, 50, 1000)
+
+
+class VirtualClockSelector(selectors.DefaultSelector):
+    """
+    A selector that, instead of sleeping until the next timer is due, moves a virtual
+    clock forward to it. Link latencies and timeouts then pass in simulated time, so a
+    busy event loop slows a run down without making bids late.
+    """
+
+    def __init__(self):
+        selectors.DefaultSelector.__init__(self)
+        self.clock = 0.0
+
+    def select(self, timeout=None):
+        if timeout is not None and timeout > 0:
+            self.clock += timeout
+            timeout = 0
+        return selectors.DefaultSelector.select(self, timeout)
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    """ An event loop whose time() is a VirtualClockSelector's clock """
+
+    def __init__(self):
+        self.clockSelector = VirtualClockSelector()
+        asyncio.SelectorEventLoop.__init__(self, self.clockSelector)
+
+    def time(self):
+        return self.clockSelector.clock
+
+
+class BidRequestState():
+    """ What an agent remembers about one bid request while it waits for its neighbors' bids """
+
+    def __init__(self, parent, message, deadline):
+        self.parent = parent
+        self.message = message
+        self.deadline = deadline
+        self.waitingFor = set()
+        self.bestBid = float('inf')
+        self.bestRoute = None
+        self.replied = False
+
+
+class NodeAgent():
+    """
+    One node of the network running as its own asyncio task. It only learns about the
+    rest of the network through the bid requests and bids in its inbox.
+
+    A bid request is passed on to every neighbor except the one it came from. An agent
+    that already has the request answers any copy of it with an infinite bid straight
+    away, so every link carries the request at most once each way. Once every neighbor
+    has bid, or the request's deadline comes, the agent bids its own utility plus the
+    best bid it received, along with that neighbor's route. The recipient bids just its
+    own utility.
+    """
+
+    def __init__(self, agentNetwork, nodeKey):
+        self.agentNetwork = agentNetwork
+        self.nodeKey = nodeKey
+        self.inbox = asyncio.Queue()
+        # requestId -> BidRequestState, kept until the request's deadline
+        self.requests = {}
+
+    async def run(self):
+        inbox = self.inbox
+        while True:
+            item = await inbox.get()
+            while True:
+                if item[0] == BID_REQUEST:
+                    self.handleBidRequest(*item[1:])
+                elif item[0] == BID:
+                    self.handleBid(*item[1:])
+                else:
+                    self.handleDeadline(*item[1:])
+                # Handle everything that is already waiting before yielding to the other agents
+                if inbox.empty():
+                    break
+                item = inbox.get_nowait()
+
+    def handleBidRequest(self, requestId, sender, message, deadline):
+        agentNetwork = self.agentNetwork
+        if requestId in self.requests or agentNetwork.now() >= deadline:
+            # Already bidding for this request, or too late to help
+            agentNetwork.send(self.nodeKey, sender, (BID, requestId, self.nodeKey, float('inf'), None))
+            return
+
+        state = BidRequestState(sender, message, deadline)
+        self.requests[requestId] = state
+        agentNetwork.requestReached(requestId)
+        if sender is not None:
+            agentNetwork.messageSeen(self.nodeKey, message)
+
+        agentNetwork.schedule(deadline, self.inbox, (DEADLINE, requestId))
+        if self.nodeKey == message.endingNode:
+            state.bestBid = 0.0
+            state.bestRoute = []
+            self.reply(requestId, state)
+            return
+
+        # Neighbors have to bid in time for this agent's own bid to reach its sender
+        neighborDeadline = deadline - agentNetwork.hopMargin
+        if agentNetwork.now() < neighborDeadline:
+            for neighbor in agentNetwork.graph.neighbors(self.nodeKey):
+                if neighbor != sender:
+                    state.waitingFor.add(neighbor)
+                    agentNetwork.send(self.nodeKey, neighbor,
+                                      (BID_REQUEST, requestId, self.nodeKey, message, neighborDeadline))
+        if len(state.waitingFor) == 0:
+            self.reply(requestId, state)
+
+    def handleBid(self, requestId, neighbor, bid, route):
+        state = self.requests.get(requestId)
+        if state is None or state.replied:
+            return  # Arrived too late
+        state.waitingFor.discard(neighbor)
+        if bid < state.bestBid:
+            state.bestBid = bid
+            state.bestRoute = route
+        if len(state.waitingFor) == 0:
+            self.reply(requestId, state)
+
+    def handleDeadline(self, requestId):
+        state = self.requests.pop(requestId)
+        if not state.replied:
+            self.reply(requestId, state)
+
+    def reply(self, requestId, state):
+        state.replied = True
+        agentNetwork = self.agentNetwork
+        if state.parent is None:
+            # This agent sent the message, so it picks the best bid and doesn't bid itself
+            agentNetwork.bidsCollected(requestId, state.bestBid, state.bestRoute)
+            return
+
+        bid = float('inf')
+        route = None
+        if state.bestRoute is not None:
+            node = agentNetwork.graph.nodes[self.nodeKey]['node']
+            bid = state.bestBid + agentNetwork.algorithm.utilityFunction(state.message, node)
+            route = [self.nodeKey] + state.bestRoute
+        agentNetwork.send(self.nodeKey, state.parent, (BID, requestId, self.nodeKey, bid, route))
+
+
+class AgentNetwork():
+    """
+    Runs every node of a Network as a NodeAgent in one asyncio event loop, so routes are
+    found by agents exchanging bid requests and bids over in-process queues rather than
+    by one search over the shared graph.
+
+    Every item sent between agents takes linkLatency seconds (plus up to latencyJitter
+    more, at random) to arrive; linkLatency may also be a function of the two node keys.
+    A sender waits at most bidTimeout seconds for its neighbors' bids, and each agent
+    gives its neighbors hopMargin seconds less than it has itself, so bids arrive in time
+    and requests stop spreading once there is no time left to answer them.
+
+    Payments are still settled by the Network, once a route has been chosen.
+    """
+
+    def __init__(self, network, linkLatency=0.001, latencyJitter=0.0, bidTimeout=1.0, hopMargin=None, seed=0,
+                 timeResolution=1e-5):
+        self.network = network
+        self.graph = network.graph
+        self.linkLatency = linkLatency
+        self.latencyJitter = latencyJitter
+        self.bidTimeout = bidTimeout
+        if hopMargin is None:
+            hopMargin = 2 * (latencyJitter + (linkLatency if not callable(linkLatency) else 0.001))
+        self.hopMargin = hopMargin
+        self.rand = random.Random(seed)
+        # Items due within the same timeResolution seconds are delivered together, with
+        # one timer between them rather than one each
+        self.timeResolution = timeResolution
+        # tick -> [(inbox, item)]
+        self.deliveries = {}
+
+        # Only used for its utility function and for pricing routes
+        self.algorithm = PathFindingAlgorithm.AgentApproach('Asynchronous agents')
+
+        self.loop = None
+        self.agents = {}
+        self.tasks = []
+        self.requestIds = itertools.count()
+        # requestId -> [future, agents reached, items sent]
+        self.pendingRequests = {}
+
+        self.itemsSent = 0
+        self.routesFound = 0
+        self.routesFailed = 0
+        self.bidTimes = []
+        self.itemsPerRoute = []
+        self.agentsPerRoute = []
+
+    async def start(self):
+        """ Starts one agent task per node """
+        self.loop = asyncio.get_event_loop()
+        for nodeKey in self.graph.nodes:
+            agent = NodeAgent(self, nodeKey)
+            self.agents[nodeKey] = agent
+            self.tasks.append(self.loop.create_task(agent.run()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def now(self):
+        return self.loop.time()
+
+    def send(self, fromKey, toKey, item):
+        """ Delivers an item to another agent's inbox after the link's latency """
+        self.itemsSent += 1
+        pending = self.pendingRequests.get(item[1])
+        if pending is not None:
+            pending[2] += 1
+
+        latency = self.linkLatency(fromKey, toKey) if callable(self.linkLatency) else self.linkLatency
+        if self.latencyJitter > 0:
+            latency += self.rand.uniform(0, self.latencyJitter)
+        inbox = self.agents[toKey].inbox
+        if latency > 0:
+            self.schedule(self.now() + latency, inbox, item)
+        else:
+            inbox.put_nowait(item)
+
+    def schedule(self, when, inbox, item):
+        """ Puts an item in an inbox at a given time, or up to timeResolution seconds after it """
+        tick = int(math.ceil(when / self.timeResolution))
+        delivery = self.deliveries.get(tick)
+        if delivery is None:
+            delivery = self.deliveries[tick] = []
+            self.loop.call_at(tick * self.timeResolution, self.deliver, tick)
+        delivery.append((inbox, item))
+
+    def deliver(self, tick):
+        for inbox, item in self.deliveries.pop(tick):
+            inbox.put_nowait(item)
+
+    def requestReached(self, requestId):
+        pending = self.pendingRequests.get(requestId)
+        if pending is not None:
+            pending[1] += 1
+
+    def messageSeen(self, nodeKey, message):
+        node = self.graph.nodes[nodeKey]['node']
+        self.algorithm.recordMessageSeen(node, message.messageId[0], message.messageId[1])
+
+    def bidsCollected(self, requestId, bestBid, bestRoute):
+        future = self.pendingRequests[requestId][0]
+        if not future.done():
+            future.set_result((bestBid, bestRoute))
+
+    async def route(self, start, end, size, content):
+        """ Has the sender's agent collect bids for a new message, returning (message, path) """
+        network = self.network
+        startKey = network.getNodeKey(start)
+        startNode = self.graph.nodes[startKey]['node']
+        message = startNode.createMessage(network.getNodeKey(end), size, content)
+
+        requestId = next(self.requestIds)
+        future = self.loop.create_future()
+        self.pendingRequests[requestId] = [future, 0, 0]
+        requestTime = self.now()
+        deadline = requestTime + self.bidTimeout
+        self.agents[startKey].inbox.put_nowait((BID_REQUEST, requestId, None, message, deadline))
+        _, bestRoute = await future
+        _, agentsReached, itemsSent = self.pendingRequests.pop(requestId)
+
+        self.bidTimes.append(self.now() - requestTime)
+        self.itemsPerRoute.append(itemsSent)
+        self.agentsPerRoute.append(agentsReached)
+        if bestRoute is None:
+            self.routesFailed += 1
+            network.stats.routeFailed()
+            return message, False
+
+        self.routesFound += 1
+        path = self.algorithm.buildPath(self.graph, message, bestRoute)
+        # Every agent that was asked counts as queried
+        network.stats.recordRun(agentsReached - 1, len(path))
+        return message, path
+
+    async def sendMessage(self, start, end, size, content):
+        message, path = await self.route(start, end, size, content)
+        if path:
+            self.network.transmitMessageAndPayment(message, path)
+
+    async def sendWorkload(self, workload, timeScale=0.0, maxInFlight=1000):
+        """
+        Sends a workload of (sendTime, start, end, size, content), with up to maxInFlight
+        messages collecting bids at once. With a timeScale, each unit of send time is
+        that many seconds, otherwise messages are sent as fast as they can be.
+        """
+        inFlight = set()
+        startTime = self.now()
+        for sendTime, start, end, size, content in workload:
+            if timeScale > 0:
+                delay = startTime + sendTime * timeScale - self.now()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if len(inFlight) >= maxInFlight:
+                done, inFlight = await asyncio.wait(inFlight, return_when=asyncio.FIRST_COMPLETED)
+            inFlight.add(self.loop.create_task(self.sendMessage(start, end, size, content)))
+        if inFlight:
+            await asyncio.wait(inFlight)
+
+    def printResults(self, wallTime=None):
+        print("The results of this agent run are:")
+        print("Routes found: " + str(self.routesFound) + ", without a route: " + str(self.routesFailed) +
+              ", agents: " + str(len(self.agents)))
+        if self.bidTimes:
+            p50, p99 = np.percentile(self.bidTimes, [50, 99]).tolist()
+            print("Bid time p50 " + format(p50 * 1e3, '.2f') + " ms, p99 " + format(p99 * 1e3, '.2f') + " ms")
+            print("Items sent per route " + format(np.mean(self.itemsPerRoute), '.1f') +
+                  ", agents reached per route " + format(np.mean(self.agentsPerRoute), '.1f'))
+        if wallTime is not None:
+            print("Took " + format(wallTime, '.3f') + " seconds for " + str(self.itemsSent) + " items (" +
+                  format(self.itemsSent / max(wallTime, 1e-9), '.0f') + " items per second)")
+        print('\n')
+
+
+def runAgentNetwork(network, workload, timeScale=0.0, maxInFlight=1000, virtualTime=True, **kwargs):
+    """
+    Runs a workload through an AgentNetwork in a new event loop, returning the
+    AgentNetwork. With virtualTime, latencies, timeouts and bid times are in simulated
+    seconds; otherwise they are real ones, and can stretch when the loop is busy.
+    """
+    agentNetwork = AgentNetwork(network, **kwargs)
+
+    async def run():
+        await agentNetwork.start()
+        try:
+            await agentNetwork.sendWorkload(workload, timeScale, maxInFlight)
+        finally:
+            await agentNetwork.stop()
+
+    loop = VirtualTimeEventLoop() if virtualTime else asyncio.new_event_loop()
+    gcThresholds = gc.get_threshold()
+    gc.set_threshold(*RUN_GC_THRESHOLDS)
+    try:
+        wallStart = time.perf_counter()
+        loop.run_until_complete(run())
+        agentNetwork.wallTime = time.perf_counter() - wallStart
+    finally:
+        gc.set_threshold(*gcThresholds)
+        loop.close()
+    return agentNetwork
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Routes messages with every node running as an asyncio agent")
+    parser.add_argument('--nodes', type=int, help="Generate a random geometric topology with this many nodes "
+                                                  "instead of loading intrinsic.csv and connections.csv")
+    parser.add_argument('--degree', type=float, default=8, help="Average degree of a generated topology")
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--inFlight', type=int, default=100, help="Messages collecting bids at once")
+    parser.add_argument('--latency', type=float, default=0.001, help="Seconds for an item to cross a link")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Up to this many more seconds per item, at random")
+    parser.add_argument('--timeout', type=float, default=1.0, help="Seconds a sender waits for bids")
+    parser.add_argument('--realTime', action='store_true', help="Use the real clock rather than simulated time")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.nodes:
+        graph = topology.geometricTopology(args.nodes, args.degree, args.seed)
+        network = Network(PathFindingAlgorithm.AgentApproach('Agent'), StatsCollector(), graph=graph)
+        names = graph.names
+    else:
+        network = Network(PathFindingAlgorithm.AgentApproach('Agent'), StatsCollector())
+        names = [network.graph.nodes[n]['node'].name for n in network.graph.nodes]
+    messages = workload.uniformWorkload(names, 1.0, seed=args.seed, count=args.messages)
+
+    agentNetwork = runAgentNetwork(network, messages, maxInFlight=args.inFlight, virtualTime=not args.realTime,
+                                   linkLatency=args.latency, latencyJitter=args.jitter, bidTimeout=args.timeout,
+                                   seed=args.seed)
+    agentNetwork.printResults(agentNetwork.wallTime)
+    network.stats.recordTime(datetime.timedelta(seconds=agentNetwork.wallTime))
+    network.stats.recordCost(network.averageCostPerMByte())
+    network.stats.printResults()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,626 @@
+import argparse
+import contextlib
+import copy
+import csv
+import io
+import itertools
+import math
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import networkx as nx
+import PathFindingAlgorithm
+import topology
+from graph import CompactGraph, Network, Node, StatsCollector
+from simulation import Simulation
+import workload
+
+
+class SyntheticMessage():
+    def __init__(self, startingNode, endingNode, messageId):
+        self.startingNode = startingNode
+        self.endingNode = endingNode
+        self.speedPref = 1
+        self.costPref = 1
+        self.size = 1
+        self.content = "Benchmark"
+        self.messageId = messageId
+
+
+class CountingStats():
+    def __init__(self):
+        self.nodesQueried = 0
+
+    def visitedNode(self):
+        self.nodesQueried += 1
+
+    def visitedNodes(self, count):
+        self.nodesQueried += count
+
+
+def gridRows(numNodes, seed=0, extraEdgeFraction=0.1, width=None):
+    """
+    Builds the intrinsic.csv and connections.csv rows for a jittered grid graph with random
+    speeds and prices, plus a few random shortcuts
+    """
+    rand = random.Random(seed)
+    if width is None:
+        width = max(int(numNodes ** 0.5), 1)
+
+    nodeRows = []
+    for i in range(numNodes):
+        row, col = divmod(i, width)
+        nodeRows.append([str(i),
+                         row + rand.uniform(-0.3, 0.3),
+                         col + rand.uniform(-0.3, 0.3),
+                         rand.uniform(0.5, 2), 1, 1, 1,
+                         rand.uniform(0.5, 2)])
+
+    edgeRows = []
+    for i in range(numNodes):
+        if (i + 1) % width != 0 and i + 1 < numNodes:
+            edgeRows.append((str(i), str(i + 1)))
+        if i + width < numNodes:
+            edgeRows.append((str(i), str(i + width)))
+
+    for _ in range(int(numNodes * extraEdgeFraction)):
+        first, second = rand.randrange(numNodes), rand.randrange(numNodes)
+        if first != second:
+            edgeRows.append((str(first), str(second)))
+    return nodeRows, edgeRows
+
+
+def writeGridFiles(directory, numNodes, seed=0):
+    """ Writes a grid graph as intrinsic.csv and connections.csv style files, returning their paths """
+    nodeRows, edgeRows = gridRows(numNodes, seed)
+    nodesPath = os.path.join(directory, 'intrinsic.csv')
+    connectionsPath = os.path.join(directory, 'connections.csv')
+    with open(nodesPath, 'w', newline='') as nodeFile:
+        csv.writer(nodeFile).writerows(nodeRows)
+    with open(connectionsPath, 'w', newline='') as connectionsFile:
+        csv.writer(connectionsFile).writerows(edgeRows)
+    return nodesPath, connectionsPath
+
+
+def buildNetworkxGraph(nodeRows, edgeRows):
+    """ Builds the graph the same way Network does """
+    graph = nx.Graph()
+    for row in nodeRows:
+        node = Node(row)
+        graph.add_node(node.name, node=node, pos=(node.long, node.lat))
+    for row in edgeRows:
+        graph.add_edge(row[0], row[1])
+    return graph
+
+
+def buildGridGraph(numNodes, seed=0, extraEdgeFraction=0.1, width=None, compact=False):
+    nodeRows, edgeRows = gridRows(numNodes, seed, extraEdgeFraction, width)
+    if compact:
+        return CompactGraph.fromRows(nodeRows, edgeRows)
+    return buildNetworkxGraph(nodeRows, edgeRows)
+
+
+class LegacyAStarAlgorithm(PathFindingAlgorithm.AStarAlgorithm):
+    """ The original list based A* search, kept as the reference for benchmarking """
+
+    def euclideanDistance(self, graph, node1, node2):
+        firstNode = self.getNode(graph, node1)
+        secondNode = self.getNode(graph, node2)
+        latDist = abs(firstNode.lat - secondNode.lat)
+        lonDist = abs(firstNode.long - secondNode.long)
+        return math.sqrt(math.pow(latDist, 2) + math.pow(lonDist, 2))
+
+    def getPath(self, graph, message, stats):
+        closedSet = []
+        openSet = [message.startingNode]
+        cameFrom = {}
+        gScores = {key: float('inf') for key in nx.nodes(graph)}
+        gScores[message.startingNode] = 0
+        fScores = {key: float('inf') for key in nx.nodes(graph)}
+        fScores[message.startingNode] = self.euclideanDistance(
+            graph, message.startingNode, message.endingNode)
+
+        messageSender = message.messageId[0]
+        messageId = message.messageId[1]
+
+        while len(openSet) > 0:
+            currFScores = {node: fScores[node] for node in openSet}
+            current = min(currFScores, key=currFScores.get)
+
+            stats.visitedNode()
+
+            if current == message.endingNode:
+                return self.reconstructPath(cameFrom, current, graph, message)
+
+            openSet.remove(current)
+            closedSet.append(current)
+
+            for neighbor in nx.all_neighbors(graph, current):
+                if neighbor in closedSet:
+                    continue
+                stats.visitedNode()
+
+                if neighbor not in openSet:
+                    openSet.append(neighbor)
+
+                neighborNode = self.getNode(graph, neighbor)
+                tentative_gScore = gScores[current] + \
+                    self.utilityFunction(message, neighborNode)
+
+                if neighborNode.seeMessage(messageSender, messageId):
+                    neighborNode.numMessagesSeen += 1
+
+                if tentative_gScore >= gScores[neighbor]:
+                    continue
+
+                cameFrom[neighbor] = current
+                gScores[neighbor] = tentative_gScore
+                fScores[neighbor] = gScores[neighbor] + \
+                    self.euclideanDistance(graph, neighbor, message.endingNode)
+
+        return False
+
+
+class LegacyAgentApproximation(PathFindingAlgorithm.AgentApproximation):
+    """ The original recursive approximation search that copies the visited list at every hop """
+
+    def getPath(self, graph, message, stats):
+        validPath, path = self.findLegacyPath(graph, message, message.startingNode, [], stats)
+        return path
+
+    def findLegacyPath(self, graph, message, currentNode, visitedNodes, stats):
+        myNode = self.getNode(graph, currentNode)
+        myPrice = myNode.costPerMByte * message.size
+
+        if currentNode == message.endingNode:
+            return True, [(currentNode, myPrice)]
+
+        currentVisitedNodes = copy.deepcopy(visitedNodes)
+        currentVisitedNodes.append(currentNode)
+
+        neighborApproximations = {}
+        notVisitedNeighbors = list(
+            set(graph.neighbors(currentNode)) - set(currentVisitedNodes))
+
+        messageSender = message.messageId[0]
+        messageId = message.messageId[1]
+        for neighbor in notVisitedNeighbors:
+            neighborApproximations[neighbor] = self.getApproximateUtility(
+                graph, message, neighbor)
+            stats.visitedNode()
+
+            neighborNode = self.getNode(graph, neighbor)
+            self.recordMessageSeen(neighborNode, messageSender, messageId)
+
+        while len(neighborApproximations) > 0:
+            bestApprox = min(neighborApproximations,
+                             key=neighborApproximations.get)
+            validPathFound, path = self.findLegacyPath(
+                graph, message, bestApprox, currentVisitedNodes, stats)
+            if validPathFound:
+                if currentNode == message.startingNode:
+                    myPrice = 0
+                    for i in range(len(path)):
+                        myPrice -= path[i][1]
+                return True, path + [(currentNode, myPrice)]
+            neighborApproximations.pop(bestApprox)
+
+        print('Returned false')
+        return False, []
+
+
+class PerCallHeuristic():
+    """ Computes each euclidean distance when it is looked up, the way A* used to """
+
+    def __init__(self, algorithm, graph, destination):
+        self.algorithm = algorithm
+        self.graph = graph
+        self.destination = destination
+
+    def __getitem__(self, node):
+        return LegacyAStarAlgorithm.euclideanDistance(self.algorithm, self.graph, node, self.destination)
+
+
+class PerCallHeuristicAStarAlgorithm(PathFindingAlgorithm.AStarAlgorithm):
+    def getHeuristic(self, graph, destination):
+        return PerCallHeuristic(self, graph, destination)
+
+
+def randomQueries(graph, numQueries, seed=0):
+    rand = random.Random(seed)
+    names = list(graph.nodes)
+    return [(rand.choice(names), rand.choice(names)) for _ in range(numQueries)]
+
+
+def timeAlgorithm(algorithm, graph, queries):
+    stats = CountingStats()
+    paths = []
+    start = time.perf_counter()
+    # Keep the algorithms' debugging output out of the results table
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i, (source, destination) in enumerate(queries):
+            message = SyntheticMessage(source, destination, ('bench', i))
+            paths.append(algorithm.getPath(graph, message, stats))
+    return time.perf_counter() - start, stats.nodesQueried, paths
+
+
+def benchmarkAStar(sizes, numQueries, seed):
+    print("A* search: heap based open set vs. original list based open set")
+    print("%10s %10s %12s %12s %10s %8s" %
+          ('nodes', 'queries', 'legacy (s)', 'heap (s)', 'speedup', 'same'))
+    for size in sizes:
+        queries = randomQueries(buildGridGraph(size, seed), numQueries, seed)
+        legacyTime, legacyQueried, legacyPaths = timeAlgorithm(
+            LegacyAStarAlgorithm('Legacy A*'), buildGridGraph(size, seed), queries)
+        heapTime, heapQueried, heapPaths = timeAlgorithm(
+            PathFindingAlgorithm.AStarAlgorithm('A*'), buildGridGraph(size, seed), queries)
+        same = legacyPaths == heapPaths and legacyQueried == heapQueried
+        print("%10d %10d %12.3f %12.3f %9.1fx %8s" %
+              (size, numQueries, legacyTime, heapTime, legacyTime / heapTime, same))
+
+
+def routeUtility(algorithm, graph, message, path):
+    return sum(algorithm.utilityFunction(message, algorithm.getNode(graph, name)) for name, _ in path[:-1])
+
+
+def benchmarkAgent(sizes, numQueries, seed):
+    print("Agent bidding: exact bid tree vs. exhaustive path enumeration")
+    print("%10s %10s %12s %12s %10s %8s" %
+          ('nodes', 'queries', 'exhaust (s)', 'exact (s)', 'speedup', 'same'))
+    for size in sizes:
+        graph = buildGridGraph(size, seed)
+        queries = [(source, destination) for source, destination in randomQueries(graph, numQueries, seed)
+                   if source != destination]
+        exhaustive = PathFindingAlgorithm.AgentApproach('Exhaustive', exhaustive=True)
+        exact = PathFindingAlgorithm.AgentApproach('Agent')
+        exhaustiveTime, _, exhaustivePaths = timeAlgorithm(exhaustive, graph, queries)
+        exactTime, _, exactPaths = timeAlgorithm(exact, graph, queries)
+        same = all(abs(routeUtility(exact, graph, SyntheticMessage(source, destination, None), first) -
+                       routeUtility(exact, graph, SyntheticMessage(source, destination, None), second)) < 1e-9
+                   for (source, destination), first, second in zip(queries, exhaustivePaths, exactPaths))
+        print("%10d %10d %12.3f %12.3f %9.1fx %8s" %
+              (size, len(queries), exhaustiveTime, exactTime, exhaustiveTime / exactTime, same))
+
+
+def measureAlgorithm(algorithm, graph, queries):
+    """ Like timeAlgorithm, but also reports the peak memory allocated, which slows the run down """
+    tracemalloc.start()
+    try:
+        result = timeAlgorithm(algorithm, graph, queries)
+        _, peak = tracemalloc.get_traced_memory()
+    except RecursionError:
+        result, peak = None, None
+    tracemalloc.stop()
+    return result, peak
+
+
+def benchmarkApproximation(sizes, width, seed):
+    print("Agent approximation: iterative shared visited set vs. recursive copied visited lists")
+    print("%10s %10s %12s %12s %12s %12s %8s" %
+          ('nodes', 'hops', 'legacy (s)', 'legacy (MB)', 'iter (s)', 'iter (MB)', 'same'))
+    for size in sizes:
+        # A long strip of nodes so the route from one end to the other is hundreds of hops long
+        graph = buildGridGraph(size, seed, extraEdgeFraction=0, width=width)
+        queries = [('0', str(size - 1))]
+
+        legacy, legacyPeak = measureAlgorithm(
+            LegacyAgentApproximation('Legacy approximation'), graph, queries)
+        iterative, iterativePeak = measureAlgorithm(
+            PathFindingAlgorithm.AgentApproximation('Approximation'), graph, queries)
+
+        hops = len(iterative[2][0]) - 1
+        if legacy is None:
+            print("%10d %10d %12s %12s %12.3f %12.2f %8s" %
+                  (size, hops, 'recursion', 'limit', iterative[0], iterativePeak / 1e6, '-'))
+        else:
+            print("%10d %10d %12.3f %12.2f %12.3f %12.2f %8s" %
+                  (size, hops, legacy[0], legacyPeak / 1e6, iterative[0], iterativePeak / 1e6,
+                   legacy[1:] == iterative[1:]))
+
+
+def benchmarkHeuristic(sizes, numQueries, seed):
+    print("A* heuristic: cached per destination distances vs. computing each distance on use")
+    print("%10s %14s %10s %14s %12s %10s %8s" %
+          ('nodes', 'destinations', 'queries', 'per call (s)', 'cached (s)', 'speedup', 'same'))
+    for size in sizes:
+        graph = buildGridGraph(size, seed)
+        # Every message goes to the same few destinations, like the repeated sends in
+        # runNetwork, or to a different destination each time
+        destinations = [destination for _, destination in randomQueries(graph, 3, seed)]
+        hotQueries = [(source, destinations[i % len(destinations)])
+                      for i, (source, _) in enumerate(randomQueries(graph, numQueries, seed + 1))]
+        for destinationsName, queries in [('hot', hotQueries), ('uniform', randomQueries(graph, numQueries, seed + 1))]:
+            perCallTime, perCallQueried, perCallPaths = timeAlgorithm(
+                PerCallHeuristicAStarAlgorithm('A*'), graph, queries)
+            cachedTime, cachedQueried, cachedPaths = timeAlgorithm(
+                PathFindingAlgorithm.AStarAlgorithm('A*'), graph, queries)
+            same = perCallPaths == cachedPaths and perCallQueried == cachedQueried
+            print("%10d %14s %10d %14.3f %12.3f %9.1fx %8s" %
+                  (size, destinationsName, numQueries, perCallTime, cachedTime, perCallTime / cachedTime, same))
+
+
+def hotDestinationBatch(names, numMessages, seed, numHot=3, hotFraction=0.9):
+    """ Messages from random senders, most of them to one of a few hot destinations """
+    rand = random.Random(seed)
+    hot = rand.sample(names, numHot)
+    batch = []
+    for i in range(numMessages):
+        end = rand.choice(hot) if rand.random() < hotFraction else rand.choice(names)
+        start = rand.choice(names)
+        while start == end:
+            start = rand.choice(names)
+        batch.append((start, end, 1, "Benchmark"))
+    return batch
+
+
+def benchmarkBatch(sizes, numMessages, seed):
+    print("Message routing: Network.sendMessages batches vs. one sendMessage at a time")
+    print("%10s %10s %10s %10s %14s %14s %10s" %
+          ('algorithm', 'nodes', 'messages', 'hot', 'single (msg/s)', 'batch (msg/s)', 'speedup'))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            nodesPath, connectionsPath = writeGridFiles(directory, size, seed)
+            names = [str(i) for i in range(size)]
+            # Every destination outside the hot few is new, and costs a bid tree and
+            # bid request topology of its own whether messages are batched or not
+            for hotFraction, makeAlgorithm in itertools.product(
+                    (0.9, 1.0), (lambda: PathFindingAlgorithm.AgentApproach('Agent'),
+                                 lambda: PathFindingAlgorithm.AStarAlgorithm('A*'))):
+                batch = hotDestinationBatch(names, numMessages, seed, hotFraction=hotFraction)
+                network = Network(makeAlgorithm(), StatsCollector(),
+                                  nodesPath=nodesPath, connectionsPath=connectionsPath)
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for message in batch:
+                        network.sendMessage(*message)
+                singleTime = time.perf_counter() - start
+
+                network = Network(makeAlgorithm(), StatsCollector(),
+                                  nodesPath=nodesPath, connectionsPath=connectionsPath)
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    network.sendMessages(batch)
+                batchTime = time.perf_counter() - start
+
+                print("%10s %10d %10d %10g %14.1f %14.1f %9.1fx" %
+                      (network.algorithm.name, size, numMessages, hotFraction, numMessages / singleTime,
+                       numMessages / batchTime, singleTime / batchTime))
+
+
+def benchmarkSimulation(sizes, numMessages, seed):
+    print("Discrete event simulation: event rate with many messages in flight, including A* routing")
+    print("%10s %10s %10s %12s %14s %12s" %
+          ('nodes', 'messages', 'events', 'wall (s)', 'events/min', 'p99 latency'))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            nodesPath, connectionsPath = writeGridFiles(directory, size, seed)
+            names = [str(i) for i in range(size)]
+            rand = random.Random(seed)
+            batch = hotDestinationBatch(names, numMessages, seed)
+            sendTimes = [0.0]
+            for _ in range(numMessages - 1):
+                sendTimes.append(sendTimes[-1] + rand.expovariate(10.0))
+
+            network = Network(PathFindingAlgorithm.AStarAlgorithm('A*', cacheRoutes=True), StatsCollector(),
+                              nodesPath=nodesPath, connectionsPath=connectionsPath)
+            simulation = Simulation(network)
+            with contextlib.redirect_stdout(io.StringIO()):
+                simulation.run((sendTime,) + message for sendTime, message in zip(sendTimes, batch))
+            print("%10d %10d %10d %12.3f %14.0f %12.2f" %
+                  (size, numMessages, simulation.eventsProcessed, simulation.wallTime,
+                   simulation.eventsProcessed / simulation.wallTime * 60, simulation.latencyPercentiles([99])[0]))
+
+
+def benchmarkTraceReplay(traceLengths, seed):
+    print("Trace replay: streaming a Zipf workload through CSV and binary traces")
+    print("%12s %8s %12s %14s %14s" %
+          ('messages', 'format', 'file (MB)', 'read (msg/s)', 'peak mem (MB)'))
+    names = [str(i) for i in range(10000)]
+    with tempfile.TemporaryDirectory() as directory:
+        for traceLength in traceLengths:
+            for traceFormat, write, read in (('csv', workload.writeCsvTrace, workload.readCsvTrace),
+                                             ('binary', workload.writeBinaryTrace, workload.readBinaryTrace)):
+                path = os.path.join(directory, 'trace.' + traceFormat)
+                generated = workload.zipfWorkload(names, 100.0, seed=seed, count=traceLength)
+                if traceFormat == 'binary':
+                    write(path, generated, names)
+                else:
+                    write(path, generated)
+
+                tracemalloc.start()
+                start = time.perf_counter()
+                for _ in read(path):
+                    pass
+                readTime = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                print("%12d %8s %12.1f %14.0f %14.2f" %
+                      (traceLength, traceFormat, os.path.getsize(path) / 1e6, traceLength / readTime, peak / 1e6))
+
+
+def benchmarkCompactGraph(sizes, numQueries, seed):
+    print("Graph storage: CompactGraph arrays vs. networkx graph of Node objects")
+    print("%10s %14s %16s %12s %12s %8s" %
+          ('nodes', 'nx (B/node)', 'compact (B/node)', 'nx A* (s)', 'compact (s)', 'same'))
+    for size in sizes:
+        nodeRows, edgeRows = gridRows(size, seed)
+
+        tracemalloc.start()
+        graph = buildNetworkxGraph(nodeRows, edgeRows)
+        networkxBytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        compactGraph = CompactGraph.fromRows(nodeRows, edgeRows)
+        compactBytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        queries = randomQueries(graph, numQueries, seed)
+        compactQueries = [(compactGraph.index[source], compactGraph.index[destination])
+                          for source, destination in queries]
+        networkxTime, networkxQueried, networkxPaths = timeAlgorithm(
+            PathFindingAlgorithm.AStarAlgorithm('A*'), graph, queries)
+        compactTime, compactQueried, compactPaths = timeAlgorithm(
+            PathFindingAlgorithm.AStarAlgorithm('A*'), compactGraph, compactQueries)
+        compactPaths = [[(compactGraph.names[node], cost) for node, cost in path] for path in compactPaths]
+        same = networkxQueried == compactQueried and networkxPaths == compactPaths
+        print("%10d %14.0f %16.0f %12.3f %12.3f %8s" %
+              (size, networkxBytes / size, compactBytes / size, networkxTime, compactTime, same))
+
+
+def longRangeQueries(graph, numQueries, seed):
+    """ Pairs of nodes from opposite corners of a generated topology """
+    rand = random.Random(seed)
+    side = max(graph.lat.max(), graph.long.max())
+    corner = [i for i in range(len(graph)) if graph.lat[i] + graph.long[i] < side * 0.3]
+    opposite = [i for i in range(len(graph)) if graph.lat[i] + graph.long[i] > side * 1.7]
+    return [(rand.choice(corner), rand.choice(opposite)) for _ in range(numQueries)]
+
+
+def benchmarkALT(sizes, numQueries, seed):
+    print("Long range routes on geometric graphs: bidirectional ALT vs. A* with the euclidean heuristic")
+    print("%10s %10s %14s %12s %12s %12s %12s %10s %10s" %
+          ('nodes', 'queries', 'landmarks (s)', 'A* queried', 'ALT queried', 'A* (s)', 'ALT (s)',
+           'A* best', 'ALT best'))
+    for size in sizes:
+        graph = topology.geometricTopology(size, 8, seed)
+        queries = longRangeQueries(graph, numQueries, seed)
+        # Without landmarks the search is a plain bidirectional Dijkstra, so its routes are
+        # optimal. Geometric graphs aren't always connected, so only keep reachable pairs.
+        _, _, bestPaths = timeAlgorithm(PathFindingAlgorithm.ALTAlgorithm('Dijkstra', numLandmarks=0), graph, queries)
+        queries, bestPaths = zip(*[(query, path) for query, path in zip(queries, bestPaths) if path])
+
+        alt = PathFindingAlgorithm.ALTAlgorithm('ALT')
+        start = time.perf_counter()
+        alt.updateLandmarks(graph)
+        landmarkTime = time.perf_counter() - start
+
+        astarTime, astarQueried, astarPaths = timeAlgorithm(PathFindingAlgorithm.AStarAlgorithm('A*'), graph, queries)
+        altTime, altQueried, altPaths = timeAlgorithm(alt, graph, queries)
+
+        def countOptimal(paths):
+            return sum(1 for (source, destination), path, best in zip(queries, paths, bestPaths)
+                       if abs(routeUtility(alt, graph, SyntheticMessage(source, destination, None), path) -
+                              routeUtility(alt, graph, SyntheticMessage(source, destination, None), best)) < 1e-9)
+
+        print("%10d %10d %14.3f %12d %12d %12.3f %12.3f %10d %10d" %
+              (size, len(queries), landmarkTime, astarQueried, altQueried, astarTime, altTime,
+               countOptimal(astarPaths), countOptimal(altPaths)))
+
+
+def benchmarkPareto(sizes, numQueries, messagesPerQuery, seed):
+    print("Messages with mixed preferences between the same nodes: one Pareto frontier per pair vs. ALT per message")
+    print("%10s %10s %10s %10s %12s %12s %10s %8s" %
+          ('nodes', 'pairs', 'messages', 'frontier', 'ALT (s)', 'Pareto (s)', 'speedup', 'same'))
+    rand = random.Random(seed)
+    for size in sizes:
+        graph = buildGridGraph(size, seed)
+        messages = []
+        for i, (source, destination) in enumerate(randomQueries(graph, numQueries, seed)):
+            for j in range(messagesPerQuery):
+                message = SyntheticMessage(source, destination, ('bench', i * messagesPerQuery + j))
+                message.speedPref = rand.random()
+                message.costPref = rand.random()
+                message.size = rand.choice([1, 2, 5, 10])
+                messages.append(message)
+
+        def timePaths(algorithm):
+            # Both share the landmarks, so only the searches are timed
+            algorithm.updateLandmarks(graph)
+            stats = CountingStats()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                paths = [algorithm.getPath(graph, message, stats) for message in messages]
+            return time.perf_counter() - start, paths
+
+        alt = PathFindingAlgorithm.ALTAlgorithm('ALT')
+        pareto = PathFindingAlgorithm.ParetoAlgorithm('Pareto')
+        altTime, altPaths = timePaths(alt)
+        paretoTime, paretoPaths = timePaths(pareto)
+        frontierSize = sum(len(frontier.routes) for frontier in pareto.frontiers.values()) / len(pareto.frontiers)
+        same = all(abs(routeUtility(alt, graph, message, first) - routeUtility(alt, graph, message, second)) < 1e-9
+                   for message, first, second in zip(messages, altPaths, paretoPaths))
+        print("%10d %10d %10d %10.1f %12.3f %12.3f %9.1fx %8s" %
+              (size, numQueries, len(messages), frontierSize, altTime, paretoTime, altTime / paretoTime, same))
+
+
+def networkState(network):
+    """ Every node's balance, price and message count """
+    nodes = network.graph.nodes
+    return [(node.balance, node.costPerMByte, node.numMessagesSeen) for node in (nodes[key]['node'] for key in nodes)]
+
+
+def benchmarkRouteCache(sizes, numMessages, numPairs, seed):
+    print("Messages between a few pairs of nodes: Network's route cache vs. searching every message")
+    print("%10s %10s %10s %10s %12s %12s %10s %8s" %
+          ('algorithm', 'nodes', 'messages', 'hits', 'uncached (s)', 'cached (s)', 'speedup', 'same'))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            nodesPath, connectionsPath = writeGridFiles(directory, size, seed)
+            names = [str(i) for i in range(size)]
+            rand = random.Random(seed)
+            pairs = [tuple(rand.sample(names, 2)) for _ in range(numPairs)]
+            batch = [rand.choice(pairs) + (rand.choice([1, 2]), "Benchmark") for _ in range(numMessages)]
+            # The cached run has to end with exactly the uncached run's balances, prices and
+            # message counts, however the price changes shift the algorithms' heuristics
+            for algorithmClass, name in ((PathFindingAlgorithm.AStarAlgorithm, 'A*'),
+                                         (PathFindingAlgorithm.ALTAlgorithm, 'ALT'),
+                                         (PathFindingAlgorithm.ParetoAlgorithm, 'Pareto'),
+                                         (PathFindingAlgorithm.AgentApproach, 'Agent')):
+                times = []
+                networks = []
+                for cacheRoutes in (False, True):
+                    network = Network(algorithmClass(name, cacheRoutes=cacheRoutes), StatsCollector(),
+                                      nodesPath=nodesPath, connectionsPath=connectionsPath)
+                    start = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        for message in batch:
+                            network.sendMessage(*message)
+                    times.append(time.perf_counter() - start)
+                    networks.append(network)
+                same = networkState(networks[0]) == networkState(networks[1])
+                print("%10s %10d %10d %10d %12.3f %12.3f %9.1fx %8s" %
+                      (name, size, numMessages, networks[1].stats.routeCacheHits, times[0], times[1],
+                       times[0] / times[1], same))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the path finding algorithms')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--agentSizes', type=int, nargs='+', default=[9, 16, 20])
+    parser.add_argument('--approximationSizes', type=int, nargs='+', default=[2000, 10000, 40000])
+    parser.add_argument('--approximationWidth', type=int, default=20)
+    parser.add_argument('--batchSizes', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--batchMessages', type=int, default=200)
+    parser.add_argument('--simulationMessages', type=int, default=20000)
+    parser.add_argument('--traceLengths', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--messagesPerPair', type=int, default=20)
+    parser.add_argument('--cacheMessages', type=int, default=1000)
+    parser.add_argument('--cachePairs', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    benchmarkAStar(args.sizes, args.queries, args.seed)
+    print('')
+    benchmarkAgent(args.agentSizes, args.queries, args.seed)
+    print('')
+    benchmarkApproximation(args.approximationSizes, args.approximationWidth, args.seed)
+    print('')
+    benchmarkCompactGraph(args.sizes, args.queries, args.seed)
+    print('')
+    benchmarkHeuristic(args.sizes, args.queries, args.seed)
+    print('')
+    benchmarkBatch(args.batchSizes, args.batchMessages, args.seed)
+    print('')
+    benchmarkSimulation(args.batchSizes, args.simulationMessages, args.seed)
+    print('')
+    benchmarkTraceReplay(args.traceLengths, args.seed)
+    print('')
+    benchmarkALT(args.sizes, args.queries, args.seed)
+    print('')
+    benchmarkPareto(args.sizes, args.queries, args.messagesPerPair, args.seed)
+    print('')
+    benchmarkRouteCache(args.batchSizes, args.cacheMessages, args.cachePairs, args.seed)
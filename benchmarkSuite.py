@@ -0,0 +1,250 @@
+import argparse
+import contextlib
+import datetime
+import heapq
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import time
+
+import PathFindingAlgorithm
+import topology
+import workload
+from benchmark import buildGridGraph, routeUtility
+from graph import Network, StatsCollector
+
+# Runs each algorithm over a matrix of topologies, graph sizes, densities and workloads.
+# Every case runs in a fresh process, so it can be stopped when it runs past the timeout
+# (the exhaustive Agent blows up exponentially) and so its peak memory is its own.
+# Results are saved as JSON, and a previous results file can be compared against.
+
+ALGORITHMS = {
+    'A*': lambda: PathFindingAlgorithm.AStarAlgorithm('A*'),
+    'ALT': lambda: PathFindingAlgorithm.ALTAlgorithm('ALT'),
+    'Agent': lambda: PathFindingAlgorithm.AgentApproach('Agent'),
+    'Exhaustive Agent': lambda: PathFindingAlgorithm.AgentApproach('Exhaustive Agent', exhaustive=True),
+    'Approximation': lambda: PathFindingAlgorithm.AgentApproximation('Approximation'),
+    'Pareto': lambda: PathFindingAlgorithm.ParetoAlgorithm('Pareto'),
+}
+
+# Each topology is built for a number of nodes and a target average degree
+TOPOLOGIES = {
+    # A grid has degree 4, so density only adds random shortcuts on top
+    'grid': lambda size, degree, seed: buildGridGraph(size, seed, extraEdgeFraction=max(degree - 4, 0) / 2.0,
+                                                      compact=True),
+    'geometric': lambda size, degree, seed: topology.geometricTopology(size, degree, seed),
+    'scaleFree': lambda size, degree, seed: topology.scaleFreeTopology(size, max(int(round(degree / 2.0)), 1), seed),
+}
+
+WORKLOADS = {
+    'uniform': lambda names, count, seed: workload.uniformWorkload(names, 1.0, seed=seed, count=count),
+    'zipf': lambda names, count, seed: workload.zipfWorkload(names, 1.0, seed=seed, count=count),
+    'mixedSizes': lambda names, count, seed: workload.uniformWorkload(names, 1.0, seed=seed, sizes=(1, 2, 5, 10),
+                                                                      count=count),
+}
+
+CASE_FIELDS = ['algorithm', 'topology', 'nodes', 'density', 'workload']
+
+
+def optimalUtility(graph, message):
+    """ The lowest total utility of any path for the message, with Dijkstra over node utilities """
+    weights = ((message.speedPref * graph.speed + message.costPref * graph.costPerMByte) * message.size).tolist()
+    start = message.startingNode
+    end = message.endingNode
+
+    distances = {start: 0.0}
+    done = set()
+    heap = [(0.0, start)]
+    while heap:
+        distance, node = heapq.heappop(heap)
+        if node in done:
+            continue
+        if node == end:
+            return distance
+        done.add(node)
+        for neighbor in graph.neighbors(node):
+            neighborDistance = distance + weights[neighbor]
+            if neighborDistance < distances.get(neighbor, float('inf')):
+                distances[neighbor] = neighborDistance
+                heapq.heappush(heap, (neighborDistance, neighbor))
+    return None
+
+
+def runCase(case, numMessages, qualityMessages, seed):
+    """
+    Sends numMessages messages for one case, timing only the routing and payments.
+    For the first qualityMessages messages the route is also compared with the lowest
+    utility route at the prices it was found with.
+    """
+    graph = TOPOLOGIES[case['topology']](case['nodes'], case['density'], seed)
+    network = Network(ALGORITHMS[case['algorithm']](), StatsCollector(), graph=graph)
+    messages = WORKLOADS[case['workload']](graph.names, numMessages, seed)
+
+    elapsed = 0.0
+    sent = 0
+    failed = 0
+    qualityRatios = []
+    for i, (_, start, end, size, content) in enumerate(messages):
+        before = time.perf_counter()
+        message, path = network.routeMessage(start, end, size, content)
+        elapsed += time.perf_counter() - before
+        sent += 1
+
+        if i < qualityMessages:
+            best = optimalUtility(graph, message)
+            if not path:
+                if best is not None:
+                    failed += 1
+            elif best:
+                qualityRatios.append(routeUtility(network.algorithm, graph, message, path) / best)
+
+        if path:
+            before = time.perf_counter()
+            network.transmitMessageAndPayment(message, path)
+            elapsed += time.perf_counter() - before
+
+    stats = network.stats
+    return {'messages': sent,
+            'seconds': elapsed,
+            'messagesPerSecond': sent / elapsed if elapsed > 0 else None,
+            # ru_maxrss is in kilobytes on Linux
+            'peakMemoryMB': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            'nodesQueriedPerHop': stats.aggregate_NQPNC / float(stats.totalRuns) if stats.totalRuns else None,
+            'averagePathLength': stats.aggregate_path_length / float(stats.totalRuns) if stats.totalRuns else None,
+            'routeQuality': sum(qualityRatios) / len(qualityRatios) if qualityRatios else None,
+            'worstRouteQuality': max(qualityRatios) if qualityRatios else None,
+            'missedRoutes': failed}
+
+
+def runCaseInChild(case, numMessages, qualityMessages, seed, results):
+    # The algorithms print as they search; keep that out of the table
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            results.put(runCase(case, numMessages, qualityMessages, seed))
+        except Exception as e:
+            results.put({'error': type(e).__name__ + ": " + str(e)})
+
+
+def runCaseWithTimeout(case, numMessages, qualityMessages, seed, timeout):
+    """ Runs a case in its own process, returning its results or a status of 'timeout' or 'error' """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=runCaseInChild, args=(case, numMessages, qualityMessages, seed, results))
+    process.start()
+    try:
+        result = results.get(timeout=timeout)
+    except Exception:
+        process.terminate()
+        process.join()
+        return {'status': 'timeout'}
+    process.join()
+    if 'error' in result:
+        result['status'] = 'error'
+    else:
+        result['status'] = 'ok'
+    return result
+
+
+def caseKey(row):
+    return tuple(row[field] for field in CASE_FIELDS)
+
+
+def currentCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def formatValue(value, spec):
+    return '-' if value is None else format(value, spec)
+
+
+def printRow(row):
+    print("%16s %10s %9d %8g %11s %8s %10s %10s %10s %10s %8s" %
+          (row['algorithm'], row['topology'], row['nodes'], row['density'], row['workload'], row['status'],
+           formatValue(row.get('messagesPerSecond'), '.1f'), formatValue(row.get('peakMemoryMB'), '.1f'),
+           formatValue(row.get('nodesQueriedPerHop'), '.2f'), formatValue(row.get('routeQuality'), '.4f'),
+           formatValue(row.get('missedRoutes'), 'd')))
+
+
+def printComparison(rows, previousPath):
+    with open(previousPath) as previousFile:
+        previous = json.load(previousFile)
+    previousRows = {caseKey(row): row for row in previous['results']}
+    print('')
+    print("Compared with " + previousPath + " (commit " + str(previous.get('commit')) + ")")
+    print("%16s %10s %9s %8s %11s %14s %14s" %
+          ('algorithm', 'topology', 'nodes', 'density', 'workload', 'msg/s ratio', 'quality diff'))
+    for row in rows:
+        old = previousRows.get(caseKey(row))
+        if old is None or row.get('messagesPerSecond') is None or old.get('messagesPerSecond') is None:
+            continue
+        qualityDiff = None
+        if row.get('routeQuality') is not None and old.get('routeQuality') is not None:
+            qualityDiff = row['routeQuality'] - old['routeQuality']
+        print("%16s %10s %9d %8g %11s %13.2fx %14s" %
+              (row['algorithm'], row['topology'], row['nodes'], row['density'], row['workload'],
+               row['messagesPerSecond'] / old['messagesPerSecond'], formatValue(qualityDiff, '+.4f')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the path finding algorithms across graph sizes, "
+                                                 "densities and workloads")
+    parser.add_argument('--algorithms', nargs='+', default=['A*', 'Agent', 'Approximation'],
+                        choices=list(ALGORITHMS))
+    parser.add_argument('--topologies', nargs='+', default=['grid', 'geometric', 'scaleFree'],
+                        choices=list(TOPOLOGIES))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--densities', type=float, nargs='+', default=[4, 8],
+                        help="Target average degrees")
+    parser.add_argument('--workloads', nargs='+', default=['uniform', 'zipf'], choices=list(WORKLOADS))
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--qualityMessages', type=int, default=20,
+                        help="How many of each case's messages to compare with the optimal route")
+    parser.add_argument('--timeout', type=float, default=120, help="Seconds before a case is stopped")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmarkResults.json')
+    parser.add_argument('--compare', help="A results file from an earlier run to compare against")
+    args = parser.parse_args()
+
+    print("%16s %10s %9s %8s %11s %8s %10s %10s %10s %10s %8s" %
+          ('algorithm', 'topology', 'nodes', 'density', 'workload', 'status',
+           'msg/s', 'peak (MB)', 'queried', 'quality', 'missed'))
+    rows = []
+    # Cases that timed out, so the same case isn't tried again on a larger graph
+    timedOut = set()
+    for algorithm in args.algorithms:
+        for topologyName in args.topologies:
+            for density in args.densities:
+                for workloadName in args.workloads:
+                    for size in sorted(args.sizes):
+                        case = {'algorithm': algorithm, 'topology': topologyName, 'nodes': size,
+                                'density': density, 'workload': workloadName}
+                        smallerCase = (algorithm, topologyName, density, workloadName)
+                        if smallerCase in timedOut:
+                            row = dict(case, status='skipped')
+                        else:
+                            row = dict(case, **runCaseWithTimeout(case, args.messages, args.qualityMessages,
+                                                                  args.seed, args.timeout))
+                            if row['status'] == 'timeout':
+                                timedOut.add(smallerCase)
+                        rows.append(row)
+                        printRow(row)
+
+    with open(args.output, 'w') as outputFile:
+        json.dump({'commit': currentCommit(),
+                   'created': datetime.datetime.now().isoformat(),
+                   'arguments': vars(args),
+                   'results': rows}, outputFile, indent=2)
+    print("Results saved to " + args.output)
+
+    if args.compare:
+        printComparison(rows, args.compare)
+
+
+if __name__ == '__main__':
+    main()
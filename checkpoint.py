@@ -0,0 +1,236 @@
+import datetime
+import json
+import os
+import numpy as np
+
+from graph import RouteCache
+
+# Snapshots of a Network's economic state: every node's balance, price and message
+# counters. A checkpoint is a directory holding a checkpoint.json manifest and one .npz
+# file per snapshot, each a set of columns rather than pickled Node objects. The first
+# snapshot, and every fullEvery'th after it, is full; the others only hold what
+# changed since the snapshot before them. Nodes are matched by name, so a checkpoint
+# saved from a networkx graph can be restored into a CompactGraph and the other way
+# around.
+#
+# The windows of messages each node saw last aren't saved: a message is only looked
+# for there during its own search, so a restored node starts with an empty window.
+# The windows' size is saved, as it decides how numMessagesSeen was counted.
+
+CHECKPOINT_VERSION = 3
+# Version 1 also saved which message each node last saw from each sender; those
+# columns are ignored. Versions before 3 don't save the window size
+READABLE_VERSIONS = [1, 2, 3]
+NODE_FIELDS = ['balance', 'costPerMByte', 'numMessagesSent', 'numMessagesSeen', 'numMessagesTransmitted']
+FIELD_TYPES = {'balance': np.float64, 'costPerMByte': np.float64, 'numMessagesSent': np.int64,
+               'numMessagesSeen': np.int64, 'numMessagesTransmitted': np.int64}
+
+
+def networkNames(network):
+    graph = network.graph
+    return list(graph.names) if network.compact else list(graph.nodes)
+
+
+def readState(network, names, order=None):
+    """
+    The network's node fields as arrays in the order of names. On a CompactGraph, order
+    gives the index of each name, if they aren't in the graph's own order.
+    """
+    graph = network.graph
+    if network.compact:
+        return {field: np.array(getattr(graph, field) if order is None else getattr(graph, field)[order],
+                                dtype=FIELD_TYPES[field]) for field in NODE_FIELDS}
+    nodes = [graph.nodes[name]['node'] for name in names]
+    return {field: np.array([getattr(node, field) for node in nodes], dtype=FIELD_TYPES[field])
+            for field in NODE_FIELDS}
+
+
+class Checkpointer():
+    """
+    Saves snapshots of a network to a checkpoint directory. Use Checkpointer.resume to
+    carry on a checkpoint after restoring from it, or Checkpointer.fork to start a new
+    checkpoint from a snapshot of another one, e.g. for a what-if branch.
+    """
+
+    def __init__(self, network, path, fullEvery=20, compress=False):
+        if os.path.exists(os.path.join(path, 'checkpoint.json')):
+            raise ValueError(path + " already holds a checkpoint; resume or fork it instead")
+        self.network = network
+        self.path = path
+        self.fullEvery = fullEvery
+        self.compress = compress
+        self.setNames(networkNames(network))
+        self.manifest = {'version': CHECKPOINT_VERSION, 'numNodes': len(self.names),
+                         'seenWindow': network.seenWindow, 'snapshots': []}
+        # The state as of the last snapshot, which the next delta is taken against
+        self.columns = None
+
+    @classmethod
+    def resume(cls, network, path, upTo=None, fullEvery=20, compress=False):
+        """
+        Restores the network from a checkpoint and carries it on. Snapshots after upTo
+        are dropped from the manifest, as they no longer follow from the network's state.
+        """
+        manifest = restoreCheckpoint(network, path, upTo)
+        checkpointer = cls.__new__(cls)
+        checkpointer.network = network
+        checkpointer.path = path
+        checkpointer.fullEvery = fullEvery
+        checkpointer.compress = compress
+        # New deltas have to number the nodes the way the full snapshot they follow does
+        checkpointer.setNames(checkpointNames(path, manifest, upTo))
+        if upTo is not None:
+            manifest['snapshots'] = manifest['snapshots'][:upTo + 1]
+        # Older checkpoints are carried on in the current format
+        manifest['version'] = CHECKPOINT_VERSION
+        manifest['seenWindow'] = network.seenWindow
+        checkpointer.manifest = manifest
+        checkpointer.columns = readState(network, checkpointer.names, checkpointer.order)
+        checkpointer.writeManifest()
+        return checkpointer
+
+    @classmethod
+    def fork(cls, network, path, newPath, upTo=None, fullEvery=20, compress=False):
+        """ Restores the network from a checkpoint, saving what follows to a new checkpoint """
+        manifest = restoreCheckpoint(network, path, upTo)
+        checkpointer = cls(network, newPath, fullEvery, compress)
+        snapshot = len(manifest['snapshots']) - 1 if upTo is None else upTo
+        checkpointer.manifest['forkedFrom'] = {'path': os.path.abspath(path), 'snapshot': snapshot}
+        return checkpointer
+
+    def setNames(self, names):
+        self.names = names
+        self.order = None
+        if self.network.compact and names != self.network.graph.names:
+            index = self.network.graph.index
+            self.order = np.array([index[name] for name in names], dtype=np.int64)
+
+    def save(self, label=None):
+        """ Saves a snapshot, returning its number """
+        os.makedirs(self.path, exist_ok=True)
+        columns = readState(self.network, self.names, self.order)
+        snapshots = self.manifest['snapshots']
+        number = len(snapshots)
+        full = self.columns is None or number % self.fullEvery == 0
+        if full:
+            arrays = dict(columns)
+            arrays['names'] = np.array(self.names, dtype=np.str_)
+            fileName = 'full-%06d.npz' % number
+        else:
+            arrays = self.delta(columns)
+            fileName = 'delta-%06d.npz' % number
+
+        save = np.savez_compressed if self.compress else np.savez
+        save(os.path.join(self.path, fileName), **arrays)
+        snapshots.append({'file': fileName, 'full': full, 'label': label,
+                          'priceEpoch': self.network.graph.graph.get('priceEpoch', 0),
+                          'created': datetime.datetime.now().isoformat()})
+        # Written last, so a snapshot that was only partly written is never restored
+        self.writeManifest()
+        self.columns = columns
+        return number
+
+    def delta(self, columns):
+        """ The nodes that changed since the last snapshot """
+        changed = np.zeros(len(self.names), dtype=bool)
+        for field in NODE_FIELDS:
+            changed |= columns[field] != self.columns[field]
+        nodes = np.flatnonzero(changed)
+        arrays = {field: columns[field][nodes] for field in NODE_FIELDS}
+        arrays['nodes'] = nodes
+        return arrays
+
+    def writeManifest(self):
+        temporaryPath = os.path.join(self.path, 'checkpoint.json.tmp')
+        with open(temporaryPath, 'w') as manifestFile:
+            json.dump(self.manifest, manifestFile, indent=2)
+        os.replace(temporaryPath, os.path.join(self.path, 'checkpoint.json'))
+
+
+def readManifest(path):
+    with open(os.path.join(path, 'checkpoint.json')) as manifestFile:
+        manifest = json.load(manifestFile)
+    if manifest.get('version') not in READABLE_VERSIONS:
+        raise ValueError(path + " was written by an unsupported checkpoint version")
+    return manifest
+
+
+def lastFullSnapshot(snapshots, upTo):
+    return max(i for i in range(upTo + 1) if snapshots[i]['full'])
+
+
+def checkpointNames(path, manifest, upTo=None):
+    """ The node names of the full snapshot that snapshot upTo follows on from """
+    snapshots = manifest['snapshots']
+    upTo = len(snapshots) - 1 if upTo is None else upTo
+    with np.load(os.path.join(path, snapshots[lastFullSnapshot(snapshots, upTo)]['file'])) as full:
+        return full['names'].tolist()
+
+
+def restoreCheckpoint(network, path, upTo=None, fields=None):
+    """
+    Sets the network's state to snapshot upTo of a checkpoint, or its latest snapshot,
+    by loading the full snapshot before it and applying the deltas in between. With
+    fields, only those node fields are restored, e.g. fields=['costPerMByte'] to warm
+    start a network from another run's prices. Nodes the checkpoint doesn't have are
+    left as they are. Restoring numMessagesSeen also restores the size of the windows
+    it was counted with.
+    Returns the checkpoint's manifest.
+    """
+    manifest = readManifest(path)
+    snapshots = manifest['snapshots']
+    if upTo is None:
+        upTo = len(snapshots) - 1
+    if not 0 <= upTo < len(snapshots):
+        raise ValueError("Snapshot " + str(upTo) + " isn't in " + path)
+    first = lastFullSnapshot(snapshots, upTo)
+    fields = NODE_FIELDS if fields is None else fields
+
+    with np.load(os.path.join(path, snapshots[first]['file'])) as full:
+        names = full['names'].tolist()
+        columns = {field: full[field] for field in NODE_FIELDS}
+    for snapshot in snapshots[first + 1:upTo + 1]:
+        with np.load(os.path.join(path, snapshot['file'])) as delta:
+            for field in NODE_FIELDS:
+                columns[field][delta['nodes']] = delta[field]
+
+    if 'numMessagesSeen' in fields and manifest.get('seenWindow', network.seenWindow) != network.seenWindow:
+        network.setSeenWindow(manifest['seenWindow'])
+    writeState(network, names, columns, fields)
+    return manifest
+
+
+def writeState(network, names, columns, fields):
+    graph = network.graph
+    if network.compact:
+        index = graph.index
+        keys = [index.get(name) for name in names]
+    else:
+        keys = [name if name in graph.nodes else None for name in names]
+    present = np.array([key is not None for key in keys], dtype=bool)
+    positions = np.flatnonzero(present)
+
+    changedPrices = []
+    if network.compact:
+        targets = np.array([keys[i] for i in positions], dtype=np.int64)
+        if 'costPerMByte' in fields:
+            changedPrices = targets[graph.costPerMByte[targets] != columns['costPerMByte'][positions]].tolist()
+        for field in fields:
+            getattr(graph, field)[targets] = columns[field][positions]
+        # A restored message count may be earlier than the current one, so message ids
+        # the windows hold can come round again
+        graph.forgetMessagesSeen(targets)
+    else:
+        nodes = [graph.nodes[keys[i]]['node'] for i in positions]
+        for field in fields:
+            for node, value in zip(nodes, columns[field][positions].tolist()):
+                if field == 'costPerMByte' and node.costPerMByte != value:
+                    changedPrices.append(node.name)
+                setattr(node, field, value)
+        for node in nodes:
+            node.messagesSeen.clear()
+
+    # Anything worked out from the old prices is out of date
+    for key in changedPrices:
+        network.priceChanged(graph.nodes[key]['node'])
+    network.routeCache = RouteCache(network.routeCache.maxSize)
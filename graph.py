@@ -1,8 +1,15 @@
+import array
+import cProfile
 import csv
+import itertools
+import json
+import pstats
+import time
 import networkx as nx
-import matplotlib.pyplot as pyplot
 import PathFindingAlgorithm
 import datetime
+from collections import Counter, OrderedDict, deque
+import numpy as np
 
 MIN_MESSAGES_BEFORE_UPDATE = 2
 DECREASE_THRESHOLD = 0.3
@@ -10,10 +17,35 @@ INCREASE_THRESHOLD = 0.7
 DECREASE_AMOUNT = 0.1
 INCREASE_AMOUNT = 0.05
 MIN_PRICE = 0.1
+# How many of the latest messages each node remembers, to tell whether a message
+# reaching it again is one it has already counted. A search's visits to a node all
+# come before the next message reaches it, so even a window of 1 counts exactly; a
+# message is only counted twice if more than this many others reach the node in
+# between two of its visits.
+MESSAGES_SEEN_WINDOW = 2
+
+
+class PricingParameters():
+    """ The constants that drive how nodes change their prices, defaulting to the module's values """
+
+    def __init__(self, minMessagesBeforeUpdate=MIN_MESSAGES_BEFORE_UPDATE,
+                 decreaseThreshold=DECREASE_THRESHOLD, increaseThreshold=INCREASE_THRESHOLD,
+                 decreaseAmount=DECREASE_AMOUNT, increaseAmount=INCREASE_AMOUNT, minPrice=MIN_PRICE):
+        self.minMessagesBeforeUpdate = minMessagesBeforeUpdate
+        self.decreaseThreshold = decreaseThreshold
+        self.increaseThreshold = increaseThreshold
+        self.decreaseAmount = decreaseAmount
+        self.increaseAmount = increaseAmount
+        self.minPrice = minPrice
+
+
+def perfCounterNs():
+    """ time.perf_counter in integer nanoseconds, as time.perf_counter_ns needs Python 3.7 """
+    return int(time.perf_counter() * 1e9)
 
 
 class Node():
-    def __init__(self, node):
+    def __init__(self, node, seenWindow=MESSAGES_SEEN_WINDOW):
         self.name = node[0]
         self.lat = float(node[1])
         self.long = float(node[2])
@@ -25,7 +57,15 @@ class Node():
         self.numMessagesSent = 0
         self.numMessagesSeen = 0
         self.numMessagesTransmitted = 0
-        self.messagesSeen = {}
+        self.messagesSeen = deque(maxlen=seenWindow)
+
+    def seeMessage(self, messageSender, messageId):
+        """ Records a message reaching the node, returning False if it is one of the last few the node saw """
+        message = (messageSender, messageId)
+        if message in self.messagesSeen:
+            return False
+        self.messagesSeen.append(message)
+        return True
 
     def createMessage(self, destination, size, content):
         self.numMessagesSent += 1
@@ -39,15 +79,15 @@ class Node():
                           )
         return message
 
-    def increasePrice(self):
-        self.numMessageSeen = 0
+    def increasePrice(self, amount=INCREASE_AMOUNT):
+        self.numMessagesSeen = 0
         self.numMessagesTransmitted = 0
-        self.costPerMByte += INCREASE_AMOUNT
+        self.costPerMByte += amount
 
-    def decreasePrice(self):
-        self.numMessageSeen = 0
+    def decreasePrice(self, amount=DECREASE_AMOUNT, minPrice=MIN_PRICE):
+        self.numMessagesSeen = 0
         self.numMessagesTransmitted = 0
-        self.costPerMByte = max(self.costPerMByte - DECREASE_AMOUNT, MIN_PRICE)
+        self.costPerMByte = max(self.costPerMByte - amount, minPrice)
 
 
 class Message():
@@ -61,33 +101,401 @@ class Message():
         self.messageId = messageId
 
 
+def arrayAttribute(arrayName):
+    """ A node attribute that reads and writes one entry of a CompactGraph array """
+    def getAttribute(self):
+        return getattr(self.graph, arrayName)[self.index].item()
+
+    def setAttribute(self, value):
+        getattr(self.graph, arrayName)[self.index] = value
+
+    return property(getAttribute, setAttribute)
+
+
+class CompactNode(Node):
+    """
+    A lightweight view of one node of a CompactGraph. It behaves like a Node, but every
+    attribute is read from and written to the graph's arrays, so views can be created
+    and thrown away freely.
+    """
+
+    def __init__(self, graph, index):
+        self.graph = graph
+        self.index = index
+
+    @property
+    def name(self):
+        return self.graph.names[self.index]
+
+    def seeMessage(self, messageSender, messageId):
+        return self.graph.seeMessage(self.index, messageSender, messageId)
+
+    def createMessage(self, destination, size, content):
+        # Messages are routed by node index, but still identified by the sender's name
+        message = Node.createMessage(self, destination, size, content)
+        message.startingNode = self.index
+        return message
+
+    lat = arrayAttribute('lat')
+    long = arrayAttribute('long')
+    speed = arrayAttribute('speed')
+    speedPref = arrayAttribute('speedPref')
+    costPref = arrayAttribute('costPref')
+    costPerMByte = arrayAttribute('costPerMByte')
+    balance = arrayAttribute('balance')
+    numMessagesSent = arrayAttribute('numMessagesSent')
+    numMessagesSeen = arrayAttribute('numMessagesSeen')
+    numMessagesTransmitted = arrayAttribute('numMessagesTransmitted')
+
+
+class CompactNodeView():
+    """ Lets a CompactGraph be used like graph.nodes on a networkx graph, keyed by node index """
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __getitem__(self, index):
+        return {'node': self.graph.nodeClass(self.graph, index)}
+
+    def __iter__(self):
+        return iter(range(len(self.graph.names)))
+
+    def __len__(self):
+        return len(self.graph.names)
+
+    def __call__(self):
+        return self
+
+
+class CompactGraph():
+    """
+    An array backed alternative to the networkx graph for large simulations.
+    Nodes are numbered 0..n-1 in the order they were loaded, adjacency is stored in
+    CSR form (the neighbors of node i are indices[indptr[i]:indptr[i+1]], in the same
+    order networkx would list them), and every per node attribute is a NumPy array.
+    The path finding algorithms run on it directly using node indices, and index
+    gives the translation from node names.
+    """
+
+    # The view graph.nodes hands out for each node
+    nodeClass = CompactNode
+
+    def __init__(self, names, indptr, indices, lat, long, speed, speedPref, costPref, costPerMByte,
+                 seenWindow=MESSAGES_SEEN_WINDOW):
+        self.names = names
+        # Built the first time a name needs translating, which large graphs may never need
+        self.indexByName = None
+        self.indptr = indptr
+        self.indices = indices
+
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.long = np.asarray(long, dtype=np.float64)
+        self.speed = np.asarray(speed, dtype=np.float64)
+        self.speedPref = np.asarray(speedPref, dtype=np.float64)
+        self.costPref = np.asarray(costPref, dtype=np.float64)
+        self.costPerMByte = np.asarray(costPerMByte, dtype=np.float64)
+
+        numNodes = len(names)
+        self.balance = np.zeros(numNodes, dtype=np.float64)
+        self.numMessagesSent = np.zeros(numNodes, dtype=np.int64)
+        self.numMessagesSeen = np.zeros(numNodes, dtype=np.int64)
+        self.numMessagesTransmitted = np.zeros(numNodes, dtype=np.int64)
+
+        # Each node's window of the messages it saw last, as seenWindow hashes of
+        # (sender, message id) in a row, allocated once any node first sees a message
+        self.seenWindow = seenWindow
+        self.messagesSeen = None
+        self.nextSeenSlot = None
+
+        # Graph level attributes, like networkx's graph.graph
+        self.graph = {'priceEpoch': 0}
+
+        self.nodes = CompactNodeView(self)
+        self.node = self.nodes
+
+    @classmethod
+    def fromRows(cls, nodeRows, edgeRows, seenWindow=MESSAGES_SEEN_WINDOW):
+        """ Builds a graph from rows in the intrinsic.csv and connections.csv formats """
+        names = []
+        columns = [[] for _ in range(6)]
+        for row in nodeRows:
+            names.append(row[0])
+            for column, value in zip(columns, (row[1], row[2], row[3], row[5], row[6], row[7])):
+                column.append(float(value))
+
+        index = {name: i for i, name in enumerate(names)}
+        edges = np.array([(index[row[0]], index[row[1]]) for row in edgeRows],
+                         dtype=np.int64).reshape(-1, 2)
+        indptr, indices = cls.buildAdjacency(len(names), edges)
+        return cls(names, indptr, indices, *columns, seenWindow=seenWindow)
+
+    @classmethod
+    def fromFiles(cls, nodesPath, connectionsPath, chunkRows=100000, seenWindow=MESSAGES_SEEN_WINDOW):
+        """
+        Builds a graph from intrinsic.csv and connections.csv style files of any size,
+        converting chunkRows rows at a time to arrays so only one chunk of parsed rows
+        is held as Python objects
+        """
+        names = []
+        columnChunks = [np.zeros((0, 7))]
+        with open(nodesPath, newline='') as nodeFile:
+            nodeRows = csv.reader(nodeFile)
+            while True:
+                chunk = list(itertools.islice(nodeRows, chunkRows))
+                if len(chunk) == 0:
+                    break
+                names.extend([row[0] for row in chunk])
+                # Joining the numeric fields lets NumPy parse the whole chunk in one call
+                values = ','.join(itertools.chain.from_iterable(row[1:8] for row in chunk))
+                columnChunks.append(np.fromstring(values, sep=',').reshape(-1, 7))
+        # One contiguous array per column. Column 3 is the capacity, which the simulation doesn't use
+        lat, long, speed, _, speedPref, costPref, costPerMByte = np.concatenate(columnChunks).T.copy()
+
+        index = {name: i for i, name in enumerate(names)}
+        edgeChunks = [np.zeros((0, 2), dtype=np.int64)]
+        with open(connectionsPath, newline='') as connectionsFile:
+            edgeRows = csv.reader(connectionsFile)
+            while True:
+                chunk = list(itertools.islice(edgeRows, chunkRows))
+                if len(chunk) == 0:
+                    break
+                sources = np.array([index[row[0]] for row in chunk], dtype=np.int64)
+                targets = np.array([index[row[1]] for row in chunk], dtype=np.int64)
+                edgeChunks.append(np.stack([sources, targets], axis=1))
+        indptr, indices = cls.buildAdjacency(len(names), np.concatenate(edgeChunks))
+
+        graph = cls(names, indptr, indices, lat, long, speed, speedPref, costPref, costPerMByte, seenWindow)
+        graph.indexByName = index
+        return graph
+
+    @classmethod
+    def fromNetworkx(cls, graph, seenWindow=None):
+        """
+        Builds a graph, including its current economic state, from a Network's networkx graph.
+        seenWindow defaults to the size of the nodes' own windows.
+        """
+        names = list(graph.nodes)
+        index = {name: i for i, name in enumerate(names)}
+        nodes = [graph.nodes[name]['node'] for name in names]
+        if seenWindow is None:
+            seenWindow = nodes[0].messagesSeen.maxlen if len(nodes) > 0 else MESSAGES_SEEN_WINDOW
+
+        degrees = [len(graph.adj[name]) for name in names]
+        indptr = np.zeros(len(names) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(degrees)
+        indices = np.fromiter((index[neighbor] for name in names for neighbor in graph.adj[name]),
+                              dtype=np.int32, count=int(indptr[-1]))
+
+        compactGraph = cls(names, indptr, indices,
+                           [n.lat for n in nodes], [n.long for n in nodes],
+                           [n.speed for n in nodes], [n.speedPref for n in nodes],
+                           [n.costPref for n in nodes], [n.costPerMByte for n in nodes], seenWindow)
+        compactGraph.balance[:] = [n.balance for n in nodes]
+        compactGraph.numMessagesSent[:] = [n.numMessagesSent for n in nodes]
+        compactGraph.numMessagesSeen[:] = [n.numMessagesSeen for n in nodes]
+        compactGraph.numMessagesTransmitted[:] = [n.numMessagesTransmitted for n in nodes]
+        for i, n in enumerate(nodes):
+            for messageSender, messageId in n.messagesSeen:
+                compactGraph.seeMessage(i, messageSender, messageId)
+        compactGraph.graph.update(graph.graph)
+        return compactGraph
+
+    @staticmethod
+    def buildAdjacency(numNodes, edges):
+        """ Builds CSR adjacency from an undirected edge list, dropping repeated edges """
+        # Each edge is listed in both directions, interleaved in file order, so a stable sort
+        # by source keeps every node's neighbors in the order networkx's add_edge would
+        sources = edges[:, [0, 1]].ravel()
+        targets = edges[:, [1, 0]].ravel()
+
+        # Keep only the first time each (source, target) pair shows up
+        _, firstSeen = np.unique(sources * numNodes + targets, return_index=True)
+        firstSeen.sort()
+        sources = sources[firstSeen]
+        targets = targets[firstSeen]
+
+        order = np.argsort(sources, kind='mergesort')
+        indptr = np.zeros(numNodes + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(sources, minlength=numNodes))
+        return indptr, targets[order].astype(np.int32)
+
+    @property
+    def index(self):
+        """ Node name -> node index """
+        if self.indexByName is None:
+            self.indexByName = {name: i for i, name in enumerate(self.names)}
+        return self.indexByName
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def neighbors(self, index):
+        return self.indices[self.indptr[index]:self.indptr[index + 1]].tolist()
+
+    def seeMessage(self, index, messageSender, messageId):
+        """ Node.seeMessage for the node at index """
+        if self.messagesSeen is None:
+            # Arrays from the array module, as they read and write single items several
+            # times faster than NumPy arrays
+            self.messagesSeen = array.array('q', [0]) * (len(self.names) * self.seenWindow)
+            self.nextSeenSlot = array.array('q', [0]) * len(self.names)
+        key = hash((messageSender, messageId))
+        start = index * self.seenWindow
+        if key in self.messagesSeen[start:start + self.seenWindow]:
+            return False
+        slot = self.nextSeenSlot[index]
+        self.messagesSeen[start + slot] = key
+        self.nextSeenSlot[index] = (slot + 1) % self.seenWindow
+        return True
+
+    def countMessagesSeen(self, indices):
+        """ Adds one message seen to each node for every time its index is in indices """
+        self.numMessagesSeen += np.bincount(indices, minlength=len(self.names))
+
+    def setSeenWindow(self, seenWindow):
+        """ Changes how many messages each node remembers, emptying every window """
+        self.seenWindow = seenWindow
+        self.forgetMessagesSeen()
+
+    def forgetMessagesSeen(self, indices=None):
+        """ Empties the windows of the nodes at indices, or of every node """
+        if self.messagesSeen is None:
+            return
+        if indices is None:
+            self.messagesSeen = None
+            self.nextSeenSlot = None
+            return
+        np.frombuffer(self.messagesSeen, dtype=np.int64).reshape(-1, self.seenWindow)[indices] = 0
+        np.frombuffer(self.nextSeenSlot, dtype=np.int64)[indices] = 0
+
+    def toNetworkx(self):
+        """ Builds a networkx graph named like the original, e.g. for drawing """
+        graph = nx.Graph()
+        for i, name in enumerate(self.names):
+            graph.add_node(name, node=self.nodeClass(self, i), pos=(self.long[i], self.lat[i]))
+        for i, name in enumerate(self.names):
+            for neighbor in self.neighbors(i):
+                graph.add_edge(name, self.names[neighbor])
+        return graph
+
+
+class RouteCache():
+    """
+    Least recently used cache of routes, keyed by (start, end, size, speedPref, costPref).
+    Each route remembers every node whose price its search looked at, and is evicted as
+    soon as one of those nodes changes its price. Every message changes the prices along
+    its own path, so the cache only pays off when the same senders and destinations come
+    round again before that happens; it is off unless the algorithm sets cacheRoutes.
+    """
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.routes = OrderedDict()
+        # For each node name, the keys of the cached routes that depend on its price
+        self.routesByNode = {}
+
+    def get(self, key):
+        if key not in self.routes:
+            return None
+        self.routes.move_to_end(key)
+        path, messagesSeen, messageSeenGroups, _ = self.routes[key]
+        return list(path), messagesSeen, messageSeenGroups
+
+    def put(self, key, path, messagesSeen, messageSeenGroups, dependencies):
+        if key in self.routes:
+            self.evict(key)
+        self.routes[key] = (tuple(path), tuple(messagesSeen), tuple(messageSeenGroups), dependencies)
+        for nodeName in dependencies:
+            self.routesByNode.setdefault(nodeName, set()).add(key)
+
+        if len(self.routes) > self.maxSize:
+            self.evict(next(iter(self.routes)))
+
+    def evict(self, key):
+        _, _, _, dependencies = self.routes.pop(key)
+        for nodeName in dependencies:
+            keys = self.routesByNode[nodeName]
+            keys.discard(key)
+            if len(keys) == 0:
+                del self.routesByNode[nodeName]
+
+    def priceChanged(self, nodeName):
+        for key in list(self.routesByNode.get(nodeName, ())):
+            self.evict(key)
+
+
 class Network():
-    def __init__(self, algorithm, stats):
-        self.graph = nx.Graph()
+    def __init__(self, algorithm, stats, compact=False,
+                 nodesPath='intrinsic.csv', connectionsPath='connections.csv', routeCacheSize=1024,
+                 pricing=None, graph=None, seenWindow=None):
         self.algorithm = algorithm
         self.stats = stats
+        self.pricing = pricing if pricing is not None else PricingParameters()
+        self.compact = compact
+        # Only used if the algorithm opts in with cacheRoutes
+        self.routeCache = RouteCache(routeCacheSize)
+
+        if graph is not None:
+            # An already built topology, e.g. from topology.loadTopology or a generator,
+            # which keeps its own window size unless seenWindow is given
+            self.graph = graph
+            self.compact = isinstance(graph, CompactGraph)
+            if seenWindow is not None:
+                self.setSeenWindow(seenWindow)
+        elif compact:
+            seenWindow = seenWindow if seenWindow is not None else MESSAGES_SEEN_WINDOW
+            self.graph = CompactGraph.fromFiles(nodesPath, connectionsPath, seenWindow=seenWindow)
+        else:
+            seenWindow = seenWindow if seenWindow is not None else MESSAGES_SEEN_WINDOW
+            self.graph = nx.Graph()
+
+            with open(nodesPath) as nodeFile:
+                nodes = csv.reader(nodeFile)
+                for n in nodes:
+                    node = Node(n, seenWindow)
+                    self.graph.add_node(node.name, node=node,
+                                        pos=(node.long, node.lat))
+
+            with open(connectionsPath) as connectionsFile:
+                connections = csv.reader(connectionsFile)
+                for c in connections:
+                    self.graph.add_edge(c[0], c[1])
+
+        # Bumped whenever a node changes its price, so algorithms can tell when cached
+        # routes or bids are out of date
+        self.graph.graph['priceEpoch'] = 0
 
-        with open('intrinsic.csv') as nodeFile:
-            nodes = csv.reader(nodeFile)
-            for n in nodes:
-                node = Node(n)
-                self.graph.add_node(node.name, node=node,
-                                    pos=(node.long, node.lat))
+    @property
+    def seenWindow(self):
+        """ How many of the latest messages each node remembers """
+        if self.compact:
+            return self.graph.seenWindow
+        for nodeName in self.graph.nodes:
+            return self.graph.nodes[nodeName]['node'].messagesSeen.maxlen
+        return MESSAGES_SEEN_WINDOW
 
-        with open('connections.csv') as connectionsFile:
-            connections = csv.reader(connectionsFile)
-            for c in connections:
-                self.graph.add_edge(c[0], c[1])
+    def setSeenWindow(self, seenWindow):
+        """ Changes how many messages each node remembers, emptying every window """
+        if self.compact:
+            self.graph.setSeenWindow(seenWindow)
+            return
+        for nodeName in self.graph.nodes:
+            self.graph.nodes[nodeName]['node'].messagesSeen = deque(maxlen=seenWindow)
 
     def draw(self):
-        pos = nx.get_node_attributes(self.graph, 'pos')
-        print(self.graph.nodes)
-        node_colors = [self.mapNodeColor(v) for v in self.graph.nodes()]
-        nx.draw(self.graph, pos, with_labels=True, node_color=node_colors)
+        graph = self.graph.toNetworkx() if self.compact else self.graph
+        pos = nx.get_node_attributes(graph, 'pos')
+        print(graph.nodes)
+        node_colors = [self.mapNodeColor(graph.nodes[v]['node']) for v in graph.nodes()]
+        nx.draw(graph, pos, with_labels=True, node_color=node_colors)
+        # Imported here so simulations that never draw don't need a display backend
+        import matplotlib.pyplot as pyplot
         pyplot.show()
 
-    def mapNodeColor(self, node):
-        n = self.graph.node[node]['node']
+    def mapNodeColor(self, n):
         if n.balance >= 1:
             if n.balance >= 20:
                 return '#16b200'
@@ -112,51 +520,243 @@ class Network():
 
     def sendMessage(self, start, end, size, content):
         #print("\nSENDING MESSAGE FROM ", start, " TO ", end)
+        if self.stats.profiling:
+            messageStart = perfCounterNs()
+        message, path = self.routeMessage(start, end, size, content)
+        #print(path)
+
+        if path:
+            self.transmitMessageAndPayment(message, path)
+        if self.stats.profiling:
+            self.stats.recordMessage(self.algorithm.name, perfCounterNs() - messageStart)
 
+    def routeMessage(self, start, end, size, content):
+        """ Creates a message from start to end and finds its path, without sending it """
         self.stats.startRun()
         #print("\nUsing algorithm type: ", self.algorithm.name)
-        startNode = self.graph.nodes[start]['node']
-        message = startNode.createMessage(end, size, content)
+        startNode = self.graph.nodes[self.getNodeKey(start)]['node']
+        message = startNode.createMessage(self.getNodeKey(end), size, content)
 
         # Get path
-        path = self.algorithm.getPath(self.graph, message, self.stats)
+        path = self.findPath(message)
+        if not path:
+            self.stats.routeFailed()
+            return message, path
         self.stats.endRun(len(path))
-        #print(path)
+        return message, path
+
+    def sendMessages(self, batch, settleTogether=False):
+        """
+        Sends a batch of (start, end, size, content) messages as if they were all sent at once.
+        Every message is routed against the prices at the start of the batch, then payments
+        and price updates are applied in batch order, or with settleTogether, all at once by
+        settleMessages.
+        Only AgentApproach shares search work between messages: its messages are routed
+        grouped by destination so they share bid trees, and the nodes each flood of bid
+        requests reaches are counted as having seen its message in one pass once the whole
+        batch is routed. Every other algorithm still searches once per message.
+        """
+        messages = []
+        for start, end, size, content in batch:
+            startNode = self.graph.nodes[self.getNodeKey(start)]['node']
+            messages.append(startNode.createMessage(self.getNodeKey(end), size, content))
+
+        paths = [None] * len(messages)
+        searchTimes = [0] * len(messages)
+        order = range(len(messages))
+        messagesSeen = []
+        sharesWork = isinstance(self.algorithm, PathFindingAlgorithm.AgentApproach)
+        if sharesWork:
+            order = sorted(order, key=lambda i: (
+                messages[i].endingNode, messages[i].speedPref, messages[i].costPref, messages[i].size))
+            self.algorithm.batchMessagesSeen = messagesSeen
+        try:
+            for i in order:
+                self.stats.startRun()
+                path = self.findPath(messages[i])
+                searchTimes[i] = self.stats.lastSearchTime
+                if not path:
+                    self.stats.routeFailed()
+                    continue
+                self.stats.endRun(len(path))
+                paths[i] = path
+        finally:
+            if sharesWork:
+                self.algorithm.batchMessagesSeen = None
+        # Nothing reads the counts until the payments, so they can all be added at once
+        self.countMessagesSeen(messagesSeen)
+
+        if settleTogether:
+            self.settleMessages(messages, paths)
+            return
+
+        for message, path, searchTime in zip(messages, paths, searchTimes):
+            if self.stats.profiling:
+                messageStart = perfCounterNs()
+            if path:
+                self.transmitMessageAndPayment(message, path)
+            if self.stats.profiling:
+                self.stats.recordMessage(self.algorithm.name, searchTime + perfCounterNs() - messageStart)
+
+    def countMessagesSeen(self, nodeKeyGroups):
+        """ Adds one message seen to every node for each group of node keys it is in """
+        if len(nodeKeyGroups) == 0:
+            return
+        nodeKeys = itertools.chain.from_iterable(nodeKeyGroups)
+        if self.compact:
+            self.graph.countMessagesSeen(np.fromiter(nodeKeys, dtype=np.int64))
+            return
+        for nodeKey, count in Counter(nodeKeys).items():
+            self.graph.nodes[nodeKey]['node'].numMessagesSeen += count
+
+    def findPath(self, message):
+        """ Gets the message's path, timing the search if the stats collector is profiling """
+        if not self.stats.profiling:
+            return self.searchPath(message)
+
+        algorithm = self.algorithm
+        utilityEvaluations = algorithm.utilityEvaluations
+        heuristicEvaluations = algorithm.heuristicEvaluations
+        self.stats.startProfiler()
+        start = perfCounterNs()
+        try:
+            path = self.searchPath(message)
+        finally:
+            elapsed = perfCounterNs() - start
+            self.stats.stopProfiler()
+        self.stats.recordSearch(algorithm.name, elapsed,
+                                algorithm.utilityEvaluations - utilityEvaluations,
+                                algorithm.heuristicEvaluations - heuristicEvaluations)
+        return path
+
+    def searchPath(self, message):
+        """ Gets the message's path from the algorithm, or from the route cache if the algorithm opted in """
+        if not self.algorithm.cacheRoutes:
+            return self.algorithm.getPath(self.graph, message, self.stats)
+
+        key = (message.startingNode, message.endingNode, message.size, message.speedPref, message.costPref)
+        cached = self.routeCache.get(key)
+        if cached is not None:
+            self.stats.routeCacheHit()
+            path, messagesSeen, messageSeenGroups = cached
+            # The nodes the original search told about its message hear about this one too
+            messageSender = message.messageId[0]
+            messageId = message.messageId[1]
+            self.algorithm.recordMessagesSeen(self.graph, [self.getNodeKey(nodeName) for nodeName in messagesSeen],
+                                              messageSender, messageId)
+            for nodeKeys in messageSeenGroups:
+                self.algorithm.recordMessagesSeen(self.graph, nodeKeys, messageSender, messageId)
+            return path
+
+        self.stats.routeCacheMiss()
+        self.algorithm.searchRecord = PathFindingAlgorithm.SearchRecord()
+        try:
+            path = self.algorithm.getPath(self.graph, message, self.stats)
+            record = self.algorithm.searchRecord
+        finally:
+            self.algorithm.searchRecord = None
 
         if path:
-            self.transmitMessageAndPayment(message, path)
+            dependencies = record.pricesRead | set(self.graph.nodes[nodeKey]['node'].name for nodeKey, _ in path)
+            self.routeCache.put(key, path, record.messagesSeen, record.messageSeenGroups, dependencies)
+        return path
+
+    def priceChanged(self, node):
+        self.graph.graph['priceEpoch'] += 1
+        self.routeCache.priceChanged(node.name)
+        if self.algorithm.priceChanged(self.graph, self.getNodeKey(node.name)):
+            self.routeCache = RouteCache(self.routeCache.maxSize)
 
-    def transmitMessageAndPayment(self, message, remainingPath):
-        if len(remainingPath) <= 0:
+    def transmitMessageAndPayment(self, message, path):
+        """
+        Settles every hop of the path in one loop, from the sender (the last entry) to the
+        receiver (the first). The path is left as it was.
+        """
+        if len(path) <= 0:
             print("ERROR!")
 
-        # Handle your own payment
-        currNode, currPayment = remainingPath[-1]
-        actualNode = self.graph.node[currNode]['node']
+        for hop in range(len(path) - 1, -1, -1):
+            currNode, currPayment = path[hop]
+            self.settleHop(currNode, currPayment)
+
+            # If you are the receiver, stop. Else, continue transmitting.
+            if currNode == message.endingNode:
+                # print("Node ", currNode, " received message: ", message.content)
+                break
+
+    def settleMessages(self, messages, paths):
+        """
+        Settles many routed messages in one call. The payments and transmission counts
+        of every hop are applied first, in a single vectorized pass on a CompactGraph,
+        then every node that was paid checks its price once, so a node's price moves at
+        most one step per batch. Messages without a path are skipped.
+        """
+        nodeKeys = []
+        payments = []
+        for message, path in zip(messages, paths):
+            if not path:
+                continue
+            for hop in range(len(path) - 1, -1, -1):
+                currNode, currPayment = path[hop]
+                nodeKeys.append(currNode)
+                payments.append(currPayment)
+                if currNode == message.endingNode:
+                    break
+
+        if self.stats.profiling:
+            start = perfCounterNs()
+        if self.compact:
+            indices = np.array(nodeKeys, dtype=np.int64)
+            np.add.at(self.graph.balance, indices, np.array(payments, dtype=np.float64))
+            np.add.at(self.graph.numMessagesTransmitted, indices, 1)
+        else:
+            for currNode, currPayment in zip(nodeKeys, payments):
+                self.applyPayment(self.graph.nodes[currNode]['node'], currPayment)
+
+        if self.stats.profiling:
+            paid = perfCounterNs()
+        # In the order the nodes were first paid
+        for currNode in dict.fromkeys(nodeKeys):
+            self.updatePrice(self.graph.nodes[currNode]['node'])
+        if self.stats.profiling:
+            self.stats.recordPhase('payment', paid - start)
+            self.stats.recordPhase('priceUpdate', perfCounterNs() - paid)
+
+    def settleHop(self, currNode, currPayment):
+        """ Applies one node's payment for a message it handled, and adjusts its price """
+        actualNode = self.graph.nodes[currNode]['node']
+        if not self.stats.profiling:
+            self.applyPayment(actualNode, currPayment)
+            self.updatePrice(actualNode)
+            return
+
+        start = perfCounterNs()
+        self.applyPayment(actualNode, currPayment)
+        paid = perfCounterNs()
+        self.updatePrice(actualNode)
+        self.stats.recordPhase('payment', paid - start)
+        self.stats.recordPhase('priceUpdate', perfCounterNs() - paid)
+
+    def applyPayment(self, actualNode, currPayment):
         actualNode.balance += currPayment
         actualNode.numMessagesTransmitted += 1
         # print("Node ", currNode, " has a current balance of: ", actualNode.balance)
 
-        if actualNode.numMessagesSeen > MIN_MESSAGES_BEFORE_UPDATE:
+    def updatePrice(self, actualNode):
+        pricing = self.pricing
+        if actualNode.numMessagesSeen > pricing.minMessagesBeforeUpdate:
             transmissionRate = actualNode.numMessagesTransmitted / actualNode.numMessagesSeen
 
-            if actualNode.costPerMByte != MIN_PRICE and transmissionRate < DECREASE_THRESHOLD:
+            if actualNode.costPerMByte != pricing.minPrice and transmissionRate < pricing.decreaseThreshold:
                # print("Decreasing from " + str(format(actualNode.costPerMByte, '.2f')) +
-                      #" to " + str(format(actualNode.costPerMByte - DECREASE_AMOUNT, '.2f')))
-                actualNode.decreasePrice()
-            elif transmissionRate > INCREASE_THRESHOLD:
+                      #" to " + str(format(actualNode.costPerMByte - pricing.decreaseAmount, '.2f')))
+                actualNode.decreasePrice(pricing.decreaseAmount, pricing.minPrice)
+                self.priceChanged(actualNode)
+            elif transmissionRate > pricing.increaseThreshold:
                 #print("Increasing from " + str(format(actualNode.costPerMByte, '.2f')) +
-                      #" to " + str(format(actualNode.costPerMByte + INCREASE_AMOUNT, '.2f')))
-                actualNode.increasePrice()
-
-        # Remove yourself from the path
-        remainingPath.pop()
-
-        # If you are the receiver, report. Else, continue transmitting.
-        if currNode != message.endingNode:
-            # print("Node ", currNode, " received message: ", message.content)
-            # else
-            return self.transmitMessageAndPayment(message, remainingPath)
+                      #" to " + str(format(actualNode.costPerMByte + pricing.increaseAmount, '.2f')))
+                actualNode.increasePrice(pricing.increaseAmount)
+                self.priceChanged(actualNode)
 
     def runNetwork(self):
         a = datetime.datetime.now()
@@ -190,15 +790,75 @@ class Network():
         b=datetime.datetime.now()
         delta = b-a
         self.stats.recordTime(delta)
+        self.stats.recordCost(self.averageCostPerMByte())
+
+    def getNodeKey(self, name):
+        """ Translates a node name to the key the graph uses for it """
+        return self.graph.index[name] if self.compact else name
+
+    def averageCostPerMByte(self):
+        if self.compact:
+            return float(self.graph.costPerMByte.mean())
         cost = 0
         for node in self.graph.nodes():
-            n = self.graph.node[node]['node']
+            n = self.graph.nodes[node]['node']
             cost += n.costPerMByte
-        cost /= float(len(self.graph.nodes))
-        self.stats.recordCost(cost)
+        return cost / float(len(self.graph.nodes))
+
+class LatencyHistogram():
+    """
+    Counts of nanosecond durations in power of two buckets: bucket b holds durations
+    from 2 ** (b - 1) up to 2 ** b, so the histogram stays small however many are added.
+    """
 
-class StatsCollector():
     def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.totalNs = 0
+        self.minNs = None
+        self.maxNs = 0
+
+    def record(self, ns):
+        bucket = ns.bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.totalNs += ns
+        if self.minNs is None or ns < self.minNs:
+            self.minNs = ns
+        if ns > self.maxNs:
+            self.maxNs = ns
+
+    def percentile(self, percent):
+        """ The upper bound of the bucket holding the given percentile """
+        if self.count == 0:
+            return None
+        target = self.count * percent / 100.0
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                return min(2 ** bucket, self.maxNs)
+        return self.maxNs
+
+    def toDict(self):
+        return {'count': self.count, 'totalNs': self.totalNs, 'minNs': self.minNs, 'maxNs': self.maxNs,
+                'p50Ns': self.percentile(50), 'p90Ns': self.percentile(90), 'p99Ns': self.percentile(99),
+                'buckets': [{'fromNs': 2 ** (bucket - 1) if bucket > 0 else 0, 'toNs': 2 ** bucket,
+                             'count': self.buckets[bucket]} for bucket in sorted(self.buckets)]}
+
+
+class StatsCollector():
+    """
+    With profile=True, Network also times path search, payments and price updates
+    separately, keeps per algorithm latency histograms of each search and of each
+    message from search to last payment, and counts the algorithm's utility and
+    heuristic evaluations. With profileSearches=True every search additionally runs
+    under cProfile, see profileStats. Without profiling, Network only checks the profiling flag.
+    """
+
+    PHASES = ['search', 'payment', 'priceUpdate']
+
+    def __init__(self, profile=False, profileSearches=False):
         #add run time for algorithm
         self.totalRuns = 0
         # Nodes queried per node chosen
@@ -207,7 +867,21 @@ class StatsCollector():
         self.aggregate_path_length = 0
         self.timeToRun = 0
         self.averageCostPerMByte = 0
+        self.routeCacheHits = 0
+        self.routeCacheMisses = 0
+        # Messages no path was found for
+        self.routeFailures = 0
 
+        self.profiling = profile or profileSearches
+        self.phaseNs = {phase: 0 for phase in self.PHASES}
+        self.phaseCalls = {phase: 0 for phase in self.PHASES}
+        # Algorithm name -> LatencyHistogram
+        self.searchLatency = {}
+        self.messageLatency = {}
+        self.utilityEvaluations = 0
+        self.heuristicEvaluations = 0
+        self.lastSearchTime = 0
+        self.profiler = cProfile.Profile() if profileSearches else None
 
     def startRun(self):
         self.current_run_nodes_queried = 0
@@ -215,10 +889,26 @@ class StatsCollector():
     def visitedNode(self):
         self.current_run_nodes_queried += 1
 
+    def visitedNodes(self, count):
+        self.current_run_nodes_queried += count
+
+    def routeCacheHit(self):
+        self.routeCacheHits += 1
+
+    def routeCacheMiss(self):
+        self.routeCacheMisses += 1
+
+    def routeFailed(self):
+        self.routeFailures += 1
+
     def endRun(self, path_length):
+        self.recordRun(self.current_run_nodes_queried, path_length)
+
+    def recordRun(self, nodesQueried, path_length):
+        """ Records a finished run whose nodes queried were counted elsewhere, e.g. by concurrent agents """
         self.aggregate_path_length += path_length
         self.totalRuns += 1
-        self.aggregate_NQPNC += self.current_run_nodes_queried/float(path_length)
+        self.aggregate_NQPNC += nodesQueried/float(path_length)
 
     def recordTime(self, timeDif):
         self.timeToRun = timeDif.total_seconds()
@@ -226,6 +916,76 @@ class StatsCollector():
     def recordCost(self, cost):
         self.averageCostPerMByte = cost;
 
+    def recordPhase(self, phase, ns):
+        self.phaseNs[phase] += ns
+        self.phaseCalls[phase] += 1
+
+    def recordSearch(self, algorithmName, ns, utilityEvaluations, heuristicEvaluations):
+        self.recordPhase('search', ns)
+        self.lastSearchTime = ns
+        self.searchLatency.setdefault(algorithmName, LatencyHistogram()).record(ns)
+        self.utilityEvaluations += utilityEvaluations
+        self.heuristicEvaluations += heuristicEvaluations
+
+    def recordMessage(self, algorithmName, ns):
+        self.messageLatency.setdefault(algorithmName, LatencyHistogram()).record(ns)
+
+    def startProfiler(self):
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def stopProfiler(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    def profileStats(self):
+        """ The cProfile results of every search so far as a pstats.Stats, or None without cProfile """
+        if self.profiler is None:
+            return None
+        return pstats.Stats(self.profiler)
+
+    def toDict(self):
+        results = {'totalRuns': self.totalRuns,
+                   'averageNodesQueriedPerNodeChosen': self.aggregate_NQPNC / float(self.totalRuns) if self.totalRuns else None,
+                   'averagePathLength': self.aggregate_path_length / float(self.totalRuns) if self.totalRuns else None,
+                   'timeToRun': self.timeToRun,
+                   'averageCostPerMByte': self.averageCostPerMByte,
+                   'routeCacheHits': self.routeCacheHits,
+                   'routeCacheMisses': self.routeCacheMisses,
+                   'routeFailures': self.routeFailures}
+        if self.profiling:
+            results['phases'] = {phase: {'totalNs': self.phaseNs[phase], 'calls': self.phaseCalls[phase]}
+                                 for phase in self.PHASES}
+            results['utilityEvaluations'] = self.utilityEvaluations
+            results['heuristicEvaluations'] = self.heuristicEvaluations
+            results['searchLatency'] = {name: histogram.toDict() for name, histogram in self.searchLatency.items()}
+            results['messageLatency'] = {name: histogram.toDict() for name, histogram in self.messageLatency.items()}
+        return results
+
+    def writeJson(self, path):
+        with open(path, 'w') as jsonFile:
+            json.dump(self.toDict(), jsonFile, indent=2)
+
+    def writeCsv(self, path):
+        """ Writes the results as metric,key,value rows, with one row per histogram bucket """
+        results = self.toDict()
+        with open(path, 'w', newline='') as csvFile:
+            writer = csv.writer(csvFile)
+            writer.writerow(['metric', 'key', 'value'])
+            for metric, value in results.items():
+                if not isinstance(value, dict):
+                    writer.writerow([metric, '', value])
+            for phase, totals in results.get('phases', {}).items():
+                writer.writerow(['phaseNs', phase, totals['totalNs']])
+                writer.writerow(['phaseCalls', phase, totals['calls']])
+            for histogramName in ['searchLatency', 'messageLatency']:
+                for algorithmName, histogram in results.get(histogramName, {}).items():
+                    for field in ['count', 'totalNs', 'minNs', 'maxNs', 'p50Ns', 'p90Ns', 'p99Ns']:
+                        writer.writerow([histogramName + '.' + field, algorithmName, histogram[field]])
+                    for bucket in histogram['buckets']:
+                        writer.writerow([histogramName + '.bucket', algorithmName + ':' + str(bucket['fromNs']) +
+                                         '-' + str(bucket['toNs']), bucket['count']])
+
     def printResults(self):
         print("The results of this test are:")
         print("The average number of nodes queried per node chosen are " + str(self.aggregate_NQPNC/float(self.totalRuns)))
@@ -233,22 +993,39 @@ class StatsCollector():
               str(self.aggregate_path_length/float(self.totalRuns)))
         print("The time it took to run this test was " + str(self.timeToRun) + " seconds")
         print("The average cost per MByte per node at the end was " + str(self.averageCostPerMByte))
+        if self.routeCacheHits + self.routeCacheMisses > 0:
+            print("The route cache answered " + str(self.routeCacheHits) + " of " +
+                  str(self.routeCacheHits + self.routeCacheMisses) + " path requests")
+        if self.routeFailures > 0:
+            print("No path was found for " + str(self.routeFailures) + " messages")
+        if self.profiling:
+            self.printProfile()
         print('\n')
 
+    def printProfile(self):
+        for phase in self.PHASES:
+            print("Time spent in " + phase + ": " + format(self.phaseNs[phase] / 1e6, '.3f') + " ms over " +
+                  str(self.phaseCalls[phase]) + " calls")
+        print("Utility evaluations: " + str(self.utilityEvaluations) +
+              ", heuristic evaluations: " + str(self.heuristicEvaluations))
+        for name, histogram in self.searchLatency.items():
+            print(name + " search latency p50 " + format(histogram.percentile(50) / 1e3, '.1f') + " us, p99 " +
+                  format(histogram.percentile(99) / 1e3, '.1f') + " us, max " + format(histogram.maxNs / 1e3, '.1f') + " us")
 
-algorithms = [PathFindingAlgorithm.AStarAlgorithm('A*'),
-              PathFindingAlgorithm.AgentApproach('Agent'),
-              PathFindingAlgorithm.AgentApproximation('Approximation')]
+if __name__ == '__main__':
+    algorithms = [PathFindingAlgorithm.AStarAlgorithm('A*'),
+                  PathFindingAlgorithm.AgentApproach('Agent'),
+                  PathFindingAlgorithm.AgentApproximation('Approximation')]
 
-for a in algorithms:
-    statsCollector = StatsCollector()
-    network = Network(a, statsCollector)
-    network.runNetwork()
-    statsCollector.printResults()
+    for a in algorithms:
+        statsCollector = StatsCollector()
+        network = Network(a, statsCollector)
+        network.runNetwork()
+        statsCollector.printResults()
 
-    for nodeName in network.graph.nodes:
-        node = network.graph.nodes[nodeName]['node']
-        print(node.name + ": " + format(node.balance, '.2f'))
-    print('\n\n')
+        for nodeName in network.graph.nodes:
+            node = network.graph.nodes[nodeName]['node']
+            print(node.name + ": " + format(node.balance, '.2f'))
+        print('\n\n')
 
-    network.draw()
+        network.draw()
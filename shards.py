@@ -0,0 +1,377 @@
+import argparse
+import contextlib
+import ctypes
+import multiprocessing
+import os
+import queue
+import time
+import numpy as np
+
+import topology
+import workload
+from graph import CompactGraph, CompactNode, Network, PricingParameters, StatsCollector
+from sweep import ALGORITHMS
+
+# Simulates one CompactGraph across several processes. The graph is split into
+# geographic partitions and each shard (worker process) owns one: it routes the
+# messages sent by its nodes and is the only process that settles payments to them or
+# changes their prices. Routes are searched over the whole graph, reading every price
+# from shared memory, and when a route leaves the shard its remaining hops are handed
+# off to the shard owning the boundary node it crosses into, which settles its own run
+# of hops and hands off the rest.
+#
+# Node attributes live in shared memory, so nothing but names and hops is pickled.
+# Each is only written by its node's owner, apart from numMessagesSeen, which every
+# search adds to: each shard keeps its own row of counts and a node's count is the
+# sum of the rows.
+
+TOPOLOGY_ARRAYS = ['indptr', 'indices', 'lat', 'long', 'speed', 'speedPref', 'costPref']
+STATE_ARRAYS = ['costPerMByte', 'balance', 'numMessagesSent', 'numMessagesTransmitted']
+# A shard's entry in the shared finished array once it has sent all its messages, or given up
+FINISHED = 1
+FAILED = 2
+
+
+def shareArray(array):
+    """ Copies an array into shared memory, returning the (buffer, dtype, shape) to pass to a worker """
+    array = np.ascontiguousarray(array)
+    buffer = multiprocessing.RawArray(ctypes.c_char, max(array.nbytes, 1))
+    sharedArray = np.frombuffer(buffer, dtype=array.dtype, count=array.size).reshape(array.shape)
+    sharedArray[...] = array
+    return buffer, array.dtype.str, array.shape
+
+
+def attachArray(shared):
+    buffer, dtype, shape = shared
+    dtype = np.dtype(dtype)
+    return np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def partitionByCoordinates(graph, numPartitions):
+    """
+    Splits a CompactGraph's nodes into numPartitions geographic cells of nearly equal
+    size by recursive coordinate bisection: the nodes are halved along whichever of
+    lat and long they are more spread out in, and each half is split again.
+    Returns the partition of each node.
+    """
+    owners = np.zeros(len(graph.names), dtype=np.int64)
+    coordinates = np.stack([graph.lat, graph.long], axis=1)
+
+    def split(nodes, first, count):
+        if count == 1 or len(nodes) == 0:
+            owners[nodes] = first
+            return
+        spread = coordinates[nodes].max(axis=0) - coordinates[nodes].min(axis=0)
+        order = np.argsort(coordinates[nodes, int(np.argmax(spread))], kind='mergesort')
+        firstCount = count // 2
+        cut = len(nodes) * firstCount // count
+        split(nodes[order[:cut]], first, firstCount)
+        split(nodes[order[cut:]], first + firstCount, count - firstCount)
+
+    split(np.arange(len(graph.names)), 0, numPartitions)
+    return owners
+
+
+def cutFraction(graph, owners):
+    """ The fraction of edges between nodes in different partitions """
+    sources = np.repeat(np.arange(len(graph.names)), np.diff(graph.indptr))
+    if len(sources) == 0:
+        return 0.0
+    return float(np.mean(owners[sources] != owners[graph.indices]))
+
+
+class ShardNode(CompactNode):
+    """ A CompactNode whose numMessagesSeen is the sum of every shard's count for it """
+
+    @property
+    def numMessagesSeen(self):
+        # Remembered, as a count is nearly always read just before it is set
+        self.lastSeenCount = int(self.graph.seenCounts[:, self.index].sum())
+        return self.lastSeenCount
+
+    @numMessagesSeen.setter
+    def numMessagesSeen(self, value):
+        # A shard only writes its own row, so a new count is stored as the change from the
+        # total. An increment is the change from the count just read, so increments other
+        # shards make meanwhile aren't lost. A reset to 0, when the owner changes the node's
+        # price, is taken from the total as it is now, since other shards may have added to
+        # it since the owner last read it.
+        current = getattr(self, 'lastSeenCount', None)
+        if value == 0 or current is None:
+            current = self.numMessagesSeen
+        self.graph.seenCounts[self.graph.shardIndex, self.index] += value - current
+        self.lastSeenCount = value
+
+
+class ShardGraph(CompactGraph):
+    """ A shard's view of the shared graph: a CompactGraph whose arrays are all in shared memory """
+
+    nodeClass = ShardNode
+
+    def __init__(self, names, arrays, seenCounts, shardIndex, seenWindow):
+        CompactGraph.__init__(self, names, *[arrays[name] for name in TOPOLOGY_ARRAYS + ['costPerMByte']],
+                              seenWindow=seenWindow)
+        self.balance = arrays['balance']
+        self.numMessagesSent = arrays['numMessagesSent']
+        self.numMessagesTransmitted = arrays['numMessagesTransmitted']
+        self.numMessagesSeen = None
+        self.seenCounts = seenCounts
+        self.shardIndex = shardIndex
+
+    def countMessagesSeen(self, indices):
+        self.seenCounts[self.shardIndex] += np.bincount(indices, minlength=len(self.names))
+
+
+class ShardNetwork(Network):
+    """ A Network that also counts its price changes in shared memory, so other shards notice them """
+
+    def __init__(self, algorithm, stats, graph, pricing, priceChanges):
+        Network.__init__(self, algorithm, stats, graph=graph, pricing=pricing)
+        self.priceChanges = priceChanges
+
+    def priceChanged(self, node):
+        Network.priceChanged(self, node)
+        self.priceChanges[self.graph.shardIndex] += 1
+
+
+class Shard():
+    """ One worker process's share of a ShardedNetwork run """
+
+    def __init__(self, shardIndex, names, shared, algorithmName, pricing, seenWindow, inboxes):
+        self.shardIndex = shardIndex
+        arrays = {name: attachArray(shared[name]) for name in TOPOLOGY_ARRAYS + STATE_ARRAYS}
+        self.graph = ShardGraph(names, arrays, attachArray(shared['seenCounts']), shardIndex, seenWindow)
+        self.owners = attachArray(shared['owners'])
+        self.priceChanges = attachArray(shared['priceChanges'])
+        self.finished = attachArray(shared['finished'])
+        self.handoffsSent = attachArray(shared['handoffsSent'])
+        self.handoffsReceived = attachArray(shared['handoffsReceived'])
+
+        self.network = ShardNetwork(ALGORITHMS[algorithmName](), StatsCollector(), self.graph,
+                                    PricingParameters(**pricing), self.priceChanges)
+        self.inboxes = inboxes
+        # shard -> hop lists waiting to be sent to it
+        self.outbox = {}
+
+        # The prices as of the last time other shards' changes were looked for
+        self.knownPrices = self.graph.costPerMByte.copy()
+        self.knownPriceChanges = int(self.priceChanges.sum())
+        self.remotePriceChanges = 0
+
+    def refreshPrices(self):
+        """ Tells the network about every price another shard changed since the last call """
+        priceChanges = int(self.priceChanges.sum())
+        if priceChanges == self.knownPriceChanges:
+            return
+        self.knownPriceChanges = priceChanges
+        prices = self.graph.costPerMByte.copy()
+        changed = np.flatnonzero(prices != self.knownPrices)
+        self.knownPrices[changed] = prices[changed]
+        for nodeKey in changed[self.owners[changed] != self.shardIndex].tolist():
+            self.remotePriceChanges += 1
+            # Not counted again, as it is another shard's change
+            Network.priceChanged(self.network, self.graph.nodes[nodeKey]['node'])
+
+    def settle(self, hops):
+        """ Settles the leading hops this shard owns, handing the rest off to the next hop's owner """
+        owners = self.owners
+        for i, (nodeKey, payment) in enumerate(hops):
+            if owners[nodeKey] != self.shardIndex:
+                self.outbox.setdefault(int(owners[nodeKey]), []).append(hops[i:])
+                self.handoffsSent[self.shardIndex] += 1
+                return
+            self.network.settleHop(nodeKey, payment)
+
+    def flush(self):
+        for shardIndex, hopLists in self.outbox.items():
+            self.inboxes[shardIndex].put(hopLists)
+        self.outbox = {}
+
+    def receive(self, timeout=None):
+        """ Settles one delivery of handed off hops, returning whether there was one """
+        try:
+            if timeout is None:
+                hopLists = self.inboxes[self.shardIndex].get_nowait()
+            else:
+                hopLists = self.inboxes[self.shardIndex].get(timeout=timeout)
+        except queue.Empty:
+            return False
+        for hops in hopLists:
+            self.settle(hops)
+        # Only counted once anything they handed on is counted as sent, so done() can't
+        # see the counts match while hops are still on their way
+        self.flush()
+        self.handoffsReceived[self.shardIndex] += len(hopLists)
+        return True
+
+    def done(self):
+        if (self.finished == FAILED).any():
+            return True
+        if not self.finished.all():
+            return False
+        received = int(self.handoffsReceived.sum())
+        return received == int(self.handoffsSent.sum())
+
+    def run(self, messages, batchSize):
+        network = self.network
+        routed = 0
+        failed = 0
+        start = time.perf_counter()
+        for batchStart in range(0, len(messages), batchSize):
+            self.refreshPrices()
+            for startName, endName, size, content in messages[batchStart:batchStart + batchSize]:
+                message, path = network.routeMessage(startName, endName, size, content)
+                if not path:
+                    failed += 1
+                    continue
+                routed += 1
+                # The path runs from the receiver back to the sender, and is settled from the sender
+                hops = []
+                for nodeKey, payment in reversed(path):
+                    hops.append((nodeKey, payment))
+                    if nodeKey == message.endingNode:
+                        break
+                self.settle(hops)
+            self.flush()
+            while self.receive():
+                pass
+
+        self.finished[self.shardIndex] = FINISHED
+        while not self.done():
+            self.receive(timeout=0.01)
+        seconds = time.perf_counter() - start
+
+        stats = network.stats
+        return {'shard': self.shardIndex,
+                'messages': len(messages),
+                'routed': routed,
+                'failed': failed,
+                'seconds': seconds,
+                'totalRuns': stats.totalRuns,
+                'aggregate_NQPNC': stats.aggregate_NQPNC,
+                'aggregate_path_length': stats.aggregate_path_length,
+                'handoffsSent': int(self.handoffsSent[self.shardIndex]),
+                'remotePriceChanges': self.remotePriceChanges}
+
+
+def runShard(shardIndex, names, shared, algorithmName, pricing, seenWindow, inboxes, messages, batchSize, results):
+    # The algorithms print as they search; keep that out of the results
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            shard = Shard(shardIndex, names, shared, algorithmName, pricing, seenWindow, inboxes)
+            results.put(shard.run(messages, batchSize))
+        except Exception as e:
+            # So the other shards stop waiting for hops this one will never settle
+            attachArray(shared['finished'])[shardIndex] = FAILED
+            results.put({'shard': shardIndex, 'error': type(e).__name__ + ": " + str(e)})
+
+
+class ShardedNetwork():
+    """
+    Runs workloads over a CompactGraph with one process per shard. Before each run the
+    graph's node attributes are copied into shared memory, and afterwards the results
+    are copied back, so the graph always holds the latest state between runs.
+    """
+
+    def __init__(self, graph, algorithmName='A*', numShards=None, pricing=None, owners=None):
+        self.graph = graph
+        self.algorithmName = algorithmName
+        self.numShards = numShards if numShards is not None else os.cpu_count()
+        self.pricing = pricing if pricing is not None else PricingParameters()
+        self.owners = owners if owners is not None else partitionByCoordinates(graph, self.numShards)
+
+        numShards = self.numShards
+        numNodes = len(graph.names)
+        self.shared = {name: shareArray(getattr(graph, name)) for name in TOPOLOGY_ARRAYS + STATE_ARRAYS}
+        self.shared['owners'] = shareArray(self.owners)
+        self.shared['seenCounts'] = shareArray(np.zeros((numShards, numNodes), dtype=np.int64))
+        for name in ['priceChanges', 'finished', 'handoffsSent', 'handoffsReceived']:
+            self.shared[name] = shareArray(np.zeros(numShards, dtype=np.int64))
+
+    def run(self, messages, batchSize=64):
+        """
+        Sends a workload of (sendTime, start, end, size, content), each message from the
+        shard owning its sender, in workload order within each shard. Returns each
+        shard's results.
+        """
+        graph = self.graph
+        for name in STATE_ARRAYS:
+            attachArray(self.shared[name])[...] = getattr(graph, name)
+        seenCounts = attachArray(self.shared['seenCounts'])
+        seenCounts[...] = 0
+        seenCounts[0] = graph.numMessagesSeen
+        for name in ['priceChanges', 'finished', 'handoffsSent', 'handoffsReceived']:
+            attachArray(self.shared[name])[...] = 0
+
+        shardMessages = [[] for _ in range(self.numShards)]
+        for _, start, end, size, content in messages:
+            shardMessages[self.owners[graph.index[start]]].append((start, end, size, content))
+
+        context = multiprocessing.get_context('spawn')
+        inboxes = [context.Queue() for _ in range(self.numShards)]
+        results = context.Queue()
+        processes = [context.Process(target=runShard,
+                                     args=(i, graph.names, self.shared, self.algorithmName, vars(self.pricing),
+                                           graph.seenWindow, inboxes, shardMessages[i], batchSize, results))
+                     for i in range(self.numShards)]
+        for process in processes:
+            process.start()
+        # Read before joining, as a process can't exit until its results are read
+        shardResults = {}
+        while len(shardResults) < len(processes):
+            try:
+                result = results.get(timeout=1)
+                shardResults[result['shard']] = result
+            except queue.Empty:
+                for i, process in enumerate(processes):
+                    if i not in shardResults and not process.is_alive() and results.empty():
+                        shardResults[i] = {'shard': i, 'error': "Exited with code " + str(process.exitcode)}
+                        attachArray(self.shared['finished'])[i] = FAILED
+        for process in processes:
+            process.join()
+        shardResults = [shardResults[i] for i in range(len(processes))]
+
+        for name in STATE_ARRAYS:
+            getattr(graph, name)[...] = attachArray(self.shared[name])
+        graph.numMessagesSeen[...] = seenCounts.sum(axis=0)
+        graph.graph['priceEpoch'] += 1
+        return shardResults
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulates a generated topology split across processes")
+    parser.add_argument('--nodes', type=int, default=100000)
+    parser.add_argument('--degree', type=float, default=6, help="Average degree of the geometric topology")
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, os.cpu_count()],
+                        help="Shard counts to compare")
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--algorithm', default='A*', choices=list(ALGORITHMS))
+    parser.add_argument('--batchSize', type=int, default=64, help="Messages routed between price refreshes")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print("%7s %12s %10s %10s %10s %10s %8s" %
+          ('shards', 'cut edges', 'routed', 'handoffs', 'seconds', 'msg/s', 'speedup'))
+    baseline = None
+    for numShards in args.shards:
+        graph = topology.geometricTopology(args.nodes, args.degree, args.seed)
+        messages = list(workload.uniformWorkload(graph.names, 1.0, seed=args.seed, count=args.messages))
+        shardedNetwork = ShardedNetwork(graph, args.algorithm, numShards)
+        shardResults = shardedNetwork.run(messages, args.batchSize)
+        errors = [result['error'] for result in shardResults if 'error' in result]
+        if errors:
+            print("%7d failed: %s" % (numShards, errors[0]))
+            continue
+
+        # The shards run side by side, so the run takes as long as the slowest one
+        seconds = max(result['seconds'] for result in shardResults)
+        throughput = len(messages) / seconds
+        if baseline is None:
+            baseline = throughput
+        print("%7d %12.4f %10d %10d %10.2f %10.1f %7.2fx" %
+              (numShards, cutFraction(graph, shardedNetwork.owners), sum(result['routed'] for result in shardResults),
+               sum(result['handoffsSent'] for result in shardResults), seconds, throughput, throughput / baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import heapq
+import time
+import numpy as np
+
+
+class NodeQueueStats():
+    def __init__(self):
+        self.messagesForwarded = 0
+        self.totalWait = 0.0
+        self.maxWait = 0.0
+
+
+class Simulation():
+    """
+    Discrete event simulation of a Network with many messages in flight at once.
+
+    Every node forwards one message at a time, first come first served, and takes
+    node.speed * message.size to pass a message on to the next node in its path.
+    Messages are routed when they are sent, using the prices at that moment, and each
+    node is paid, and may change its price, when the message reaches it, so prices
+    move in event time while other messages are still travelling.
+
+    Events are plain (time, sequence, messageId, hop) tuples on a heap, and in flight
+    messages are kept in a dict until they are delivered.
+    """
+
+    def __init__(self, network):
+        self.network = network
+        self.now = 0.0
+        self.events = []
+        self.sequence = 0
+
+        # messageId -> [message, path, sendTime]
+        self.inFlight = {}
+        self.nextMessageId = 0
+        # The message a run read from its workload but stopped before sending
+        self.pendingSend = None
+
+        # Time at which each node will be done forwarding the messages it already has
+        self.busyUntil = {}
+        self.queueStats = {}
+
+        self.eventsProcessed = 0
+        self.messagesSent = 0
+        self.messagesDelivered = 0
+        self.messagesFailed = 0
+        self.latencies = []
+        self.firstSendTime = None
+        self.lastDeliveryTime = None
+        self.wallTime = 0.0
+
+    def schedule(self, sendTime, start, end, size, content):
+        """ Sends a message from start to end at sendTime """
+        messageId = self.nextMessageId
+        self.nextMessageId += 1
+        self.inFlight[messageId] = [(start, end, size, content), None, sendTime]
+        self.pushEvent(sendTime, messageId, -1)
+
+    def pushEvent(self, eventTime, messageId, hop):
+        heapq.heappush(self.events, (eventTime, self.sequence, messageId, hop))
+        self.sequence += 1
+
+    def run(self, workload=(), until=float('inf')):
+        """
+        Runs until there are no events left, or until the given simulated time.
+        workload is an iterable of (sendTime, start, end, size, content) in send time order.
+        It is read lazily, one message ahead, so it may be a generator of any length. To
+        run a workload in pieces, pass the same iterator to every call; the message read
+        ahead when a run stops is sent by the next one.
+        """
+        workload = iter(workload)
+        nextSend = self.pendingSend if self.pendingSend is not None else next(workload, None)
+        self.pendingSend = None
+        wallStart = time.perf_counter()
+
+        while True:
+            # Feed messages in from the workload as they come due
+            if nextSend is not None and (len(self.events) == 0 or nextSend[0] <= self.events[0][0]):
+                if nextSend[0] > until:
+                    self.pendingSend = nextSend
+                    break
+                self.schedule(*nextSend)
+                nextSend = next(workload, None)
+                continue
+
+            if len(self.events) == 0 or self.events[0][0] > until:
+                break
+
+            eventTime, _, messageId, hop = heapq.heappop(self.events)
+            self.now = eventTime
+            self.eventsProcessed += 1
+            if hop < 0:
+                self.sendMessage(messageId)
+            else:
+                self.arrive(messageId, hop)
+
+        self.wallTime += time.perf_counter() - wallStart
+
+    def sendMessage(self, messageId):
+        entry = self.inFlight[messageId]
+        start, end, size, content = entry[0]
+        message, path = self.network.routeMessage(start, end, size, content)
+
+        self.messagesSent += 1
+        if self.firstSendTime is None:
+            self.firstSendTime = self.now
+        if not path:
+            self.messagesFailed += 1
+            del self.inFlight[messageId]
+            return
+
+        entry[0] = message
+        entry[1] = path
+        # The sender handles the message straight away
+        self.arrive(messageId, len(path) - 1)
+
+    def arrive(self, messageId, hop):
+        """ The message reaches path[hop]. Paths run from the destination (0) back to the sender. """
+        entry = self.inFlight[messageId]
+        message, path, sendTime = entry
+        nodeKey, payment = path[hop]
+        self.network.settleHop(nodeKey, payment)
+
+        if hop == 0:
+            self.messagesDelivered += 1
+            self.latencies.append(self.now - sendTime)
+            self.lastDeliveryTime = self.now
+            del self.inFlight[messageId]
+            return
+
+        # Wait for the node to finish forwarding the messages ahead of this one
+        node = self.network.graph.nodes[nodeKey]['node']
+        startTime = max(self.now, self.busyUntil.get(nodeKey, 0.0))
+        doneTime = startTime + node.speed * message.size
+        self.busyUntil[nodeKey] = doneTime
+
+        queueStats = self.queueStats.get(nodeKey)
+        if queueStats is None:
+            queueStats = self.queueStats[nodeKey] = NodeQueueStats()
+        wait = startTime - self.now
+        queueStats.messagesForwarded += 1
+        queueStats.totalWait += wait
+        if wait > queueStats.maxWait:
+            queueStats.maxWait = wait
+
+        self.pushEvent(doneTime, messageId, hop - 1)
+
+    def latencyPercentiles(self, percentiles=(50, 90, 99)):
+        if len(self.latencies) == 0:
+            return [float('nan')] * len(percentiles)
+        return np.percentile(self.latencies, percentiles).tolist()
+
+    def throughput(self):
+        """ Messages delivered per unit of simulated time """
+        if self.lastDeliveryTime is None or self.lastDeliveryTime <= self.firstSendTime:
+            return float('nan')
+        return self.messagesDelivered / (self.lastDeliveryTime - self.firstSendTime)
+
+    def printResults(self, numQueues=10):
+        p50, p90, p99 = self.latencyPercentiles()
+        print("The results of this simulation are:")
+        print("Messages sent: " + str(self.messagesSent) + ", delivered: " + str(self.messagesDelivered) +
+              ", without a path: " + str(self.messagesFailed) + ", still in flight: " + str(len(self.inFlight)))
+        print("Throughput was " + format(self.throughput(), '.3f') + " messages per unit of simulated time")
+        print("Latency p50 " + format(p50, '.3f') + ", p90 " + format(p90, '.3f') + ", p99 " + format(p99, '.3f'))
+        print("Processed " + str(self.eventsProcessed) + " events in " + format(self.wallTime, '.3f') +
+              " seconds (" + format(self.eventsProcessed / max(self.wallTime, 1e-9), '.0f') + " events per second)")
+
+        print("Busiest queues (node: forwarded, average wait, max wait):")
+        busiest = sorted(self.queueStats.items(), key=lambda item: item[1].totalWait, reverse=True)
+        for nodeKey, queueStats in busiest[:numQueues]:
+            name = self.network.graph.nodes[nodeKey]['node'].name
+            print("  " + name + ": " + str(queueStats.messagesForwarded) + ", " +
+                  format(queueStats.totalWait / queueStats.messagesForwarded, '.3f') + ", " +
+                  format(queueStats.maxWait, '.3f'))
+        print('\n')
@@ -0,0 +1,158 @@
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import PathFindingAlgorithm
+import workload
+from graph import Network, StatsCollector, PricingParameters
+
+# Runs every combination of algorithm, pricing parameters, topology and seed in its
+# own process. Each configuration is a plain dict so it can be pickled to a worker,
+# and each worker builds its own Network and StatsCollector from it.
+
+ALGORITHMS = {
+    'A*': lambda: PathFindingAlgorithm.AStarAlgorithm('A*'),
+    'ALT': lambda: PathFindingAlgorithm.ALTAlgorithm('ALT'),
+    'Agent': lambda: PathFindingAlgorithm.AgentApproach('Agent'),
+    'Approximation': lambda: PathFindingAlgorithm.AgentApproximation('Approximation'),
+    'Pareto': lambda: PathFindingAlgorithm.ParetoAlgorithm('Pareto'),
+}
+
+PRICING_FIELDS = ['minMessagesBeforeUpdate', 'decreaseThreshold', 'increaseThreshold',
+                  'decreaseAmount', 'increaseAmount', 'minPrice']
+
+RESULT_FIELDS = ['algorithm', 'nodesPath', 'connectionsPath', 'seed', 'workload', 'messages'] + PRICING_FIELDS + \
+                ['runs', 'nodesQueriedPerNodeChosen', 'averagePathLength', 'averageCostPerMByte',
+                 'totalBalance', 'seconds', 'error']
+
+
+def buildGrid(algorithms, topologies, seeds, pricingGrid, workloadName='runNetwork', messages=0):
+    """
+    Every combination of the given algorithm names, (nodesPath, connectionsPath) pairs,
+    seeds and pricing parameters. pricingGrid maps PricingParameters field names to the
+    list of values to try; fields left out keep their defaults.
+    """
+    defaults = vars(PricingParameters())
+    pricingValues = [pricingGrid.get(field, [defaults[field]]) for field in PRICING_FIELDS]
+
+    for algorithm, (nodesPath, connectionsPath), seed, values in itertools.product(
+            algorithms, topologies, seeds, itertools.product(*pricingValues)):
+        yield {'algorithm': algorithm, 'nodesPath': nodesPath, 'connectionsPath': connectionsPath,
+               'seed': seed, 'workload': workloadName, 'messages': messages,
+               'pricing': dict(zip(PRICING_FIELDS, values))}
+
+
+def sendConfigurationWorkload(network, config):
+    if config['workload'] == 'runNetwork':
+        network.runNetwork()
+        return
+    names = [network.graph.nodes[n]['node'].name for n in network.graph.nodes]
+    if config['workload'] == 'uniform':
+        messages = workload.uniformWorkload(names, 1.0, seed=config['seed'], count=config['messages'])
+    elif config['workload'] == 'zipf':
+        messages = workload.zipfWorkload(names, 1.0, seed=config['seed'], count=config['messages'])
+    else:
+        raise ValueError("Unknown workload " + config['workload'])
+    workload.sendWorkload(network, messages)
+
+
+def runConfiguration(config, quiet=True):
+    """ Runs one configuration from buildGrid and returns its row of the results table """
+    row = {field: config[field] for field in RESULT_FIELDS[:6]}
+    row.update(config['pricing'])
+    row['error'] = ''
+
+    statsCollector = StatsCollector()
+    start = time.perf_counter()
+    try:
+        # The algorithms print as they search; keep that out of the table
+        output = contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.suppress()
+        with output:
+            network = Network(ALGORITHMS[config['algorithm']](), statsCollector,
+                              nodesPath=config['nodesPath'], connectionsPath=config['connectionsPath'],
+                              pricing=PricingParameters(**config['pricing']))
+            sendConfigurationWorkload(network, config)
+    except Exception as e:
+        row['error'] = type(e).__name__ + ": " + str(e)
+        return row
+    row['seconds'] = time.perf_counter() - start
+
+    row['runs'] = statsCollector.totalRuns
+    if statsCollector.totalRuns > 0:
+        row['nodesQueriedPerNodeChosen'] = statsCollector.aggregate_NQPNC / float(statsCollector.totalRuns)
+        row['averagePathLength'] = statsCollector.aggregate_path_length / float(statsCollector.totalRuns)
+    nodes = [network.graph.nodes[n]['node'] for n in network.graph.nodes]
+    row['averageCostPerMByte'] = sum(node.costPerMByte for node in nodes) / len(nodes)
+    row['totalBalance'] = sum(node.balance for node in nodes)
+    return row
+
+
+def runSweep(configs, workers=None, quiet=True):
+    """ Runs the configurations across a pool of processes, returning the rows in configuration order """
+    configs = list(configs)
+    if workers == 1:
+        return [runConfiguration(config, quiet) for config in configs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(runConfiguration, configs, itertools.repeat(quiet)))
+
+
+def formatValue(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return format(value, '.4g')
+    return str(value)
+
+
+def printTable(rows):
+    columns = [field for field in RESULT_FIELDS if any(row.get(field) not in (None, '') for row in rows)]
+    cells = [[formatValue(row.get(field)) for field in columns] for row in rows]
+    widths = [max([len(column)] + [len(line[i]) for line in cells]) for i, column in enumerate(columns)]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for line in cells:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+
+
+def writeCsv(path, rows):
+    with open(path, 'w', newline='') as resultsFile:
+        writer = csv.DictWriter(resultsFile, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a grid of algorithms, pricing parameters, "
+                                                 "topologies and seeds, one process per configuration")
+    parser.add_argument('--algorithms', nargs='+', default=list(ALGORITHMS), choices=list(ALGORITHMS))
+    parser.add_argument('--topologies', nargs='+', default=['intrinsic.csv:connections.csv'],
+                        help="nodesPath:connectionsPath pairs")
+    parser.add_argument('--seeds', nargs='+', type=int, default=[0])
+    parser.add_argument('--workload', default='runNetwork', choices=['runNetwork', 'uniform', 'zipf'],
+                        help="runNetwork sends Network.runNetwork's fixed messages, the others are from workload.py")
+    parser.add_argument('--messages', type=int, default=100, help="Messages to send for the uniform and zipf workloads")
+    for field in PRICING_FIELDS:
+        parser.add_argument('--' + field, nargs='+', type=int if field == 'minMessagesBeforeUpdate' else float)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', help="Also write the results table to this CSV file")
+    parser.add_argument('--verbose', action='store_true', help="Let the algorithms print while they run")
+    args = parser.parse_args()
+
+    topologies = [tuple(topology.split(':', 1)) for topology in args.topologies]
+    pricingGrid = {field: getattr(args, field) for field in PRICING_FIELDS if getattr(args, field) is not None}
+    messages = 0 if args.workload == 'runNetwork' else args.messages
+    configs = buildGrid(args.algorithms, topologies, args.seeds, pricingGrid, args.workload, messages)
+
+    rows = runSweep(configs, args.workers, quiet=not args.verbose)
+    printTable(rows)
+    if args.output:
+        writeCsv(args.output, rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import contextlib
+import io
+import os
+import unittest
+import PathFindingAlgorithm
+from graph import Network, StatsCollector
+from simulation import Simulation
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def demoWorkload():
+    """ A generator of messages between the demo network's nodes, one every 10 time units """
+    pairs = [('D', 'M'), ('A', 'C'), ('C', 'K'), ('L', 'M'), ('B', 'R'), ('A', 'T')]
+    for i, (start, end) in enumerate(pairs):
+        yield (i * 10.0, start, end, 1, "Hello!")
+
+
+class SimulationTest(unittest.TestCase):
+    def newSimulation(self):
+        network = Network(PathFindingAlgorithm.AStarAlgorithm('A*'), StatsCollector(),
+                          nodesPath=os.path.join(DIRECTORY, 'intrinsic.csv'),
+                          connectionsPath=os.path.join(DIRECTORY, 'connections.csv'))
+        return Simulation(network)
+
+    def testRunInSlices(self):
+        whole = self.newSimulation()
+        with contextlib.redirect_stdout(io.StringIO()):
+            whole.run(demoWorkload())
+
+        sliced = self.newSimulation()
+        workload = demoWorkload()
+        with contextlib.redirect_stdout(io.StringIO()):
+            sliced.run(workload, until=25)
+            self.assertEqual(sliced.messagesSent, 3)
+            sliced.run(workload)
+
+        self.assertEqual(sliced.messagesSent, whole.messagesSent)
+        self.assertEqual(sliced.messagesDelivered, whole.messagesDelivered)
+        self.assertEqual(sliced.latencies, whole.latencies)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import csv
+import itertools
+import json
+import math
+import os
+import random
+import numpy as np
+
+from graph import CompactGraph
+
+# Loading and generating large topologies as CompactGraphs.
+#
+# A parsed topology can be cached as a directory of .npy files, one per array, which
+# are memory mapped when loaded: the operating system pages them in on demand, so a
+# repeat run starts without reparsing or even reading the whole file. The cache is
+# keyed on the size and modification time of the files it was parsed from.
+
+CACHE_VERSION = 1
+CACHE_ARRAYS = ['indptr', 'indices', 'lat', 'long', 'speed', 'speedPref', 'costPref', 'costPerMByte']
+# Arrays the simulation never writes to can be mapped read only; the node attributes
+# are mapped copy on write, so changing a price never touches the file
+READ_ONLY_ARRAYS = ['indptr', 'indices']
+
+
+def sourceSignature(paths):
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def writeTopologyCache(graph, cachePath, sources=()):
+    """ Saves a CompactGraph's topology and node attributes, remembering the files it came from """
+    os.makedirs(cachePath, exist_ok=True)
+    np.save(os.path.join(cachePath, 'names.npy'), np.array(graph.names, dtype=np.str_))
+    for arrayName in CACHE_ARRAYS:
+        np.save(os.path.join(cachePath, arrayName + '.npy'), np.ascontiguousarray(getattr(graph, arrayName)))
+
+    # Written last, so a cache that was only partly written is never used
+    with open(os.path.join(cachePath, 'topology.json'), 'w') as metaFile:
+        json.dump({'version': CACHE_VERSION, 'numNodes': len(graph.names),
+                   'sources': sourceSignature(sources)}, metaFile)
+
+
+def readTopologyCache(cachePath, sources=()):
+    """ Maps in a cache written by writeTopologyCache, or returns None if it is missing or out of date """
+    try:
+        with open(os.path.join(cachePath, 'topology.json')) as metaFile:
+            meta = json.load(metaFile)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION or meta.get('sources') != sourceSignature(sources):
+        return None
+
+    names = np.load(os.path.join(cachePath, 'names.npy')).tolist()
+    arrays = {}
+    for arrayName in CACHE_ARRAYS:
+        mode = 'r' if arrayName in READ_ONLY_ARRAYS else 'c'
+        arrays[arrayName] = np.load(os.path.join(cachePath, arrayName + '.npy'), mmap_mode=mode)
+    return CompactGraph(names, **arrays)
+
+
+def loadTopology(nodesPath, connectionsPath, cachePath=None, chunkRows=100000):
+    """
+    Loads intrinsic.csv and connections.csv style files from any path as a CompactGraph.
+    With a cachePath, the parsed topology is saved there the first time and memory
+    mapped on later runs, until either file changes.
+    """
+    if cachePath is not None:
+        graph = readTopologyCache(cachePath, (nodesPath, connectionsPath))
+        if graph is not None:
+            return graph
+
+    graph = CompactGraph.fromFiles(nodesPath, connectionsPath, chunkRows)
+    if cachePath is not None:
+        writeTopologyCache(graph, cachePath, (nodesPath, connectionsPath))
+    return graph
+
+
+def writeTopologyCsv(graph, nodesPath, connectionsPath, chunkRows=100000):
+    """ Writes a CompactGraph out in the intrinsic.csv and connections.csv formats """
+    numNodes = len(graph.names)
+    with open(nodesPath, 'w', newline='') as nodeFile:
+        writer = csv.writer(nodeFile)
+        for start in range(0, numNodes, chunkRows):
+            end = min(start + chunkRows, numNodes)
+            # The capacity column isn't used by the simulation, so it is always 1
+            writer.writerows(zip(graph.names[start:end],
+                                 graph.lat[start:end].tolist(), graph.long[start:end].tolist(),
+                                 graph.speed[start:end].tolist(), itertools.repeat(1),
+                                 graph.speedPref[start:end].tolist(), graph.costPref[start:end].tolist(),
+                                 graph.costPerMByte[start:end].tolist()))
+
+    # Each undirected edge once, from its lower numbered end
+    sources = np.repeat(np.arange(numNodes), np.diff(graph.indptr))
+    keep = sources < graph.indices
+    sources = sources[keep]
+    targets = graph.indices[keep]
+    with open(connectionsPath, 'w', newline='') as connectionsFile:
+        writer = csv.writer(connectionsFile)
+        for start in range(0, len(sources), chunkRows):
+            writer.writerows((graph.names[s], graph.names[t]) for s, t in
+                             zip(sources[start:start + chunkRows].tolist(), targets[start:start + chunkRows].tolist()))
+
+
+def buildGeneratedGraph(lat, long, edges, randomState):
+    """ A CompactGraph named 0..n-1 with random speeds and prices, like benchmark.gridRows """
+    numNodes = len(lat)
+    names = [str(i) for i in range(numNodes)]
+    indptr, indices = CompactGraph.buildAdjacency(numNodes, edges)
+    return CompactGraph(names, indptr, indices, lat, long,
+                        randomState.uniform(0.5, 2, numNodes),
+                        np.ones(numNodes), np.ones(numNodes),
+                        randomState.uniform(0.5, 2, numNodes))
+
+
+def geometricTopology(numNodes, averageDegree=6, seed=0):
+    """
+    A random geometric graph: nodes are scattered uniformly over a square with one node
+    per unit of area, like the grids in benchmark.py, and every pair of nodes closer
+    than the radius that gives averageDegree neighbors on average is connected.
+    """
+    randomState = np.random.RandomState(seed)
+    side = math.sqrt(numNodes)
+    lat = randomState.uniform(0, side, numNodes)
+    long = randomState.uniform(0, side, numNodes)
+    radius = math.sqrt(averageDegree / math.pi)
+
+    # Bucket the nodes into radius sized cells, so each node only needs comparing with
+    # the nodes in its own cell and the neighboring ones
+    cellsPerSide = max(int(math.ceil(side / radius)), 1)
+    cellX = np.minimum((long / radius).astype(np.int64), cellsPerSide - 1)
+    cellY = np.minimum((lat / radius).astype(np.int64), cellsPerSide - 1)
+    cell = cellY * cellsPerSide + cellX
+    order = np.argsort(cell, kind='mergesort')
+    cellCount = np.bincount(cell, minlength=cellsPerSide * cellsPerSide)
+    cellStart = np.zeros_like(cellCount)
+    cellStart[1:] = np.cumsum(cellCount)[:-1]
+
+    edgeChunks = [np.zeros((0, 2), dtype=np.int64)]
+    # Half of the neighboring cells, so every pair of cells is only compared once
+    for dx, dy in [(0, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]:
+        otherX = cellX + dx
+        otherY = cellY + dy
+        valid = (otherX >= 0) & (otherX < cellsPerSide) & (otherY < cellsPerSide)
+        sources = np.nonzero(valid)[0]
+        otherCell = otherY[valid] * cellsPerSide + otherX[valid]
+
+        # Pair each source with every node of its other cell
+        counts = cellCount[otherCell]
+        firstPair = np.cumsum(counts) - counts
+        offsets = np.arange(counts.sum()) - np.repeat(firstPair, counts)
+        targets = order[np.repeat(cellStart[otherCell], counts) + offsets]
+        sources = np.repeat(sources, counts)
+
+        keep = (lat[sources] - lat[targets]) ** 2 + (long[sources] - long[targets]) ** 2 <= radius * radius
+        if dx == 0 and dy == 0:
+            keep &= sources < targets
+        edgeChunks.append(np.stack([sources[keep], targets[keep]], axis=1))
+
+    return buildGeneratedGraph(lat, long, np.concatenate(edgeChunks), randomState)
+
+
+def scaleFreeTopology(numNodes, edgesPerNode=2, seed=0):
+    """
+    A Barabasi-Albert preferential attachment graph: each node after the first
+    edgesPerNode connects to edgesPerNode distinct earlier nodes, chosen with
+    probability proportional to their degree. Positions are uniform over a square
+    with one node per unit of area.
+    """
+    rand = random.Random(seed)
+    randomState = np.random.RandomState(seed)
+    side = math.sqrt(numNodes)
+    lat = randomState.uniform(0, side, numNodes)
+    long = randomState.uniform(0, side, numNodes)
+
+    # Every node appears here once per edge it has, so a uniform pick is degree weighted.
+    # Read in pairs, it is also the edge list.
+    endpoints = []
+    for node in range(edgesPerNode, numNodes):
+        if node == edgesPerNode:
+            chosen = list(range(edgesPerNode))
+        else:
+            chosen = []
+            while len(chosen) < edgesPerNode:
+                target = endpoints[int(rand.random() * len(endpoints))]
+                if target not in chosen:
+                    chosen.append(target)
+        for target in chosen:
+            endpoints.append(node)
+            endpoints.append(target)
+
+    edges = np.array(endpoints, dtype=np.int64).reshape(-1, 2)
+    return buildGeneratedGraph(lat, long, edges, randomState)
@@ -0,0 +1,154 @@
+import bisect
+import csv
+import itertools
+import random
+import struct
+
+# Workloads are iterables of (sendTime, start, end, size, content) tuples in send time
+# order, the form Simulation.run reads. Everything here is a generator, so a workload
+# of any length only ever holds one message in memory.
+
+BINARY_TRACE_MAGIC = b'SIMTRACE'
+BINARY_TRACE_VERSION = 1
+# sendTime, start index, end index, size
+BINARY_TRACE_RECORD = struct.Struct('<dIId')
+
+
+def poissonArrivals(rate, rand, startTime=0.0):
+    """ Send times with exponentially distributed gaps, rate messages per unit of time on average """
+    sendTime = startTime
+    while True:
+        sendTime += rand.expovariate(rate)
+        yield sendTime
+
+
+def burstyArrivals(burstRate, meanBurstLength, meanGapLength, rand, startTime=0.0):
+    """
+    Send times that alternate between bursts, with burstRate messages per unit of time,
+    and quiet gaps with none. Burst and gap lengths are exponentially distributed.
+    """
+    sendTime = startTime
+    while True:
+        burstEnd = sendTime + rand.expovariate(1.0 / meanBurstLength)
+        sendTime += rand.expovariate(burstRate)
+        while sendTime < burstEnd:
+            yield sendTime
+            sendTime += rand.expovariate(burstRate)
+        sendTime = burstEnd + rand.expovariate(1.0 / meanGapLength)
+
+
+def buildWorkload(arrivals, chooseEndpoints, sizes, rand, count):
+    for i, sendTime in enumerate(arrivals if count is None else itertools.islice(arrivals, count)):
+        start, end = chooseEndpoints()
+        yield (sendTime, start, end, rand.choice(sizes), "Message " + str(i))
+
+
+def uniformEndpoints(names, rand):
+    def chooseEndpoints():
+        start = rand.choice(names)
+        end = rand.choice(names)
+        while end == start:
+            end = rand.choice(names)
+        return start, end
+    return chooseEndpoints
+
+
+def uniformWorkload(names, rate, seed=0, sizes=(1,), count=None):
+    """ Poisson arrivals between uniformly random pairs of distinct nodes """
+    rand = random.Random(seed)
+    return buildWorkload(poissonArrivals(rate, rand), uniformEndpoints(names, rand), sizes, rand, count)
+
+
+def zipfWorkload(names, rate, exponent=1.0, seed=0, sizes=(1,), count=None):
+    """
+    Poisson arrivals from uniformly random senders to Zipf distributed destinations:
+    the destination of popularity rank r is chosen with weight 1 / r ** exponent,
+    with the ranks handed out to the nodes in a random order fixed by the seed.
+    """
+    rand = random.Random(seed)
+    ranked = list(names)
+    rand.shuffle(ranked)
+    cumulativeWeights = list(itertools.accumulate(1.0 / rank ** exponent for rank in range(1, len(ranked) + 1)))
+    totalWeight = cumulativeWeights[-1]
+
+    def chooseEndpoints():
+        end = ranked[bisect.bisect(cumulativeWeights, rand.random() * totalWeight)]
+        start = rand.choice(names)
+        while start == end:
+            start = rand.choice(names)
+        return start, end
+
+    return buildWorkload(poissonArrivals(rate, rand), chooseEndpoints, sizes, rand, count)
+
+
+def burstyWorkload(names, burstRate, meanBurstLength, meanGapLength, seed=0, sizes=(1,), count=None):
+    """ Bursty arrivals (see burstyArrivals) between uniformly random pairs of distinct nodes """
+    rand = random.Random(seed)
+    arrivals = burstyArrivals(burstRate, meanBurstLength, meanGapLength, rand)
+    return buildWorkload(arrivals, uniformEndpoints(names, rand), sizes, rand, count)
+
+
+def writeCsvTrace(path, workload):
+    """ Writes a workload as sendTime,start,end,size,content rows, returning the number written """
+    count = 0
+    with open(path, 'w', newline='') as traceFile:
+        writer = csv.writer(traceFile)
+        for sendTime, start, end, size, content in workload:
+            writer.writerow((repr(sendTime), start, end, size, content))
+            count += 1
+    return count
+
+
+def readCsvTrace(path):
+    with open(path, newline='') as traceFile:
+        for row in csv.reader(traceFile):
+            yield (float(row[0]), row[1], row[2], float(row[3]), row[4])
+
+
+def writeBinaryTrace(path, workload, names):
+    """
+    Writes a workload in a compact binary form: a header with the node names, then one
+    fixed size record of (sendTime, start index, end index, size) per message.
+    Message content isn't kept. Returns the number of messages written.
+    """
+    index = {name: i for i, name in enumerate(names)}
+    count = 0
+    with open(path, 'wb') as traceFile:
+        traceFile.write(BINARY_TRACE_MAGIC)
+        traceFile.write(struct.pack('<II', BINARY_TRACE_VERSION, len(names)))
+        for name in names:
+            encoded = name.encode('utf-8')
+            traceFile.write(struct.pack('<H', len(encoded)))
+            traceFile.write(encoded)
+
+        for sendTime, start, end, size, _ in workload:
+            traceFile.write(BINARY_TRACE_RECORD.pack(sendTime, index[start], index[end], size))
+            count += 1
+    return count
+
+
+def readBinaryTrace(path, chunkRecords=65536, content=""):
+    """ Streams a trace written by writeBinaryTrace, reading chunkRecords messages at a time """
+    with open(path, 'rb') as traceFile:
+        if traceFile.read(len(BINARY_TRACE_MAGIC)) != BINARY_TRACE_MAGIC:
+            raise ValueError(path + " is not a binary trace")
+        version, numNames = struct.unpack('<II', traceFile.read(8))
+        if version != BINARY_TRACE_VERSION:
+            raise ValueError("Unsupported binary trace version " + str(version))
+        names = []
+        for _ in range(numNames):
+            length, = struct.unpack('<H', traceFile.read(2))
+            names.append(traceFile.read(length).decode('utf-8'))
+
+        while True:
+            chunk = traceFile.read(BINARY_TRACE_RECORD.size * chunkRecords)
+            if len(chunk) == 0:
+                break
+            for sendTime, start, end, size in BINARY_TRACE_RECORD.iter_unpack(chunk):
+                yield (sendTime, names[start], names[end], size, content)
+
+
+def sendWorkload(network, workload):
+    """ Sends every message in a workload one after another with Network.sendMessage, ignoring send times """
+    for _, start, end, size, content in workload:
+        network.sendMessage(start, end, size, content)